@@ -0,0 +1,226 @@
+import argparse
+import sys
+
+
+def build(args):
+    if args.model in ("dflowfm", "all"):
+        from new_york_df import modelname, modelws
+        from new_york_workspace import provision_workspace
+
+        provision_workspace(
+            modelws,
+            modelname=modelname,
+            build_kwargs={
+                "tstop": args.sim_length,
+                "forcing": args.forcing,
+            },
+            verbose=True,
+        )
+    if args.model in ("mf6", "all"):
+        from new_york_build_mf import build_mf6
+        from new_york_mf import modelname, modelws
+
+        build_mf6(modelws, modelname=modelname, transient=False, xyz=None)
+    return
+
+
+def run_df(args):
+    from new_york_df import main
+
+    main(
+        plot=not args.no_plot,
+        sim_length=args.sim_length,
+        forcing=args.forcing,
+    )
+    return
+
+
+def run_mf(args):
+    from new_york_mf import main
+
+    main()
+    return
+
+
+def run_coupled(args):
+    from new_york_dfmf import hysteresis_options, main
+
+    hysteresis_options = dict(hysteresis_options)
+    for key in hysteresis_options:
+        if getattr(args, key) is not None:
+            hysteresis_options[key] = getattr(args, key)
+    main(
+        record_exchange=args.record_exchange,
+        use_emulator=args.emulator,
+        exchange_bus_name=args.exchange_bus,
+        hysteresis_options=hysteresis_options,
+        sim_length=args.sim_length,
+        forcing=args.forcing,
+    )
+    return
+
+
+def monitor(args):
+    from new_york_exchange_bus import monitor
+
+    monitor(args.name, timeout=args.timeout)
+    return
+
+
+def plot(args):
+    import matplotlib
+
+    if args.output is not None:
+        matplotlib.use("Agg")
+    import flopy
+    import matplotlib.pyplot as plt
+
+    hds = flopy.utils.HeadFile(args.head_file)
+    head = hds.get_data(idx=len(hds.get_times()) - 1)
+    head = head[args.layer]
+    head[head > 1e20] = float("nan")
+
+    fig, ax = plt.subplots()
+    im = ax.imshow(head)
+    ax.set_title(f"{args.head_file}, layer {args.layer + 1}")
+    fig.colorbar(im, ax=ax, label="head, in meters")
+    if args.output is None:
+        plt.show()
+    else:
+        fig.savefig(args.output)
+    return
+
+
+def add_dflowfm_options(parser):
+    parser.add_argument(
+        "--sim-length",
+        type=float,
+        default=86400.0,
+        help="D-FLOW FM (and MODFLOW 6) run length, in seconds "
+        + "(default: 86400)",
+    )
+    parser.add_argument(
+        "--forcing",
+        choices=("astronomic", "timeseries"),
+        default="astronomic",
+        help="D-FLOW FM boundary forcing; timeseries applies the cached "
+        + "tide engine stage used by the surrogate recording "
+        + "(default: astronomic)",
+    )
+    return
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        prog="new_york",
+        description="Build, run, and plot the New York simple model",
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    p = subparsers.add_parser("build", help="build the model input files")
+    p.add_argument(
+        "--model",
+        choices=("dflowfm", "mf6", "all"),
+        default="all",
+        help="model to build (default: all)",
+    )
+    add_dflowfm_options(p)
+    p.set_defaults(func=build)
+
+    p = subparsers.add_parser("run-df", help="run D-FLOW FM")
+    p.add_argument(
+        "--no-plot",
+        action="store_true",
+        help="do not plot water depths and levels during the run",
+    )
+    add_dflowfm_options(p)
+    p.set_defaults(func=run_df)
+
+    p = subparsers.add_parser("run-mf", help="run steady-state MODFLOW 6")
+    p.set_defaults(func=run_mf)
+
+    p = subparsers.add_parser(
+        "run-coupled",
+        help="run coupled D-FLOW FM and MODFLOW 6",
+    )
+    p.add_argument(
+        "--record-exchange",
+        action="store_true",
+        help="save the D-FLOW FM water levels and depths",
+    )
+    p.add_argument(
+        "--emulator",
+        action="store_true",
+        help="use the linear-response emulator instead of MODFLOW 6",
+    )
+    p.add_argument(
+        "--exchange-bus",
+        default=None,
+        metavar="NAME",
+        help="publish the coupled state on a shared-memory exchange bus",
+    )
+    p.add_argument(
+        "--wet-depth",
+        type=float,
+        default=None,
+        help="water depth above which a dry cell becomes wet (default: 0)",
+    )
+    p.add_argument(
+        "--dry-depth",
+        type=float,
+        default=None,
+        help="water depth at or below which a wet cell becomes dry "
+        + "(default: 0)",
+    )
+    p.add_argument(
+        "--min-dwell",
+        type=float,
+        default=None,
+        help="minimum time, in seconds, between switches of a cell "
+        + "(default: 0)",
+    )
+    add_dflowfm_options(p)
+    p.set_defaults(func=run_coupled)
+
+    p = subparsers.add_parser(
+        "monitor",
+        help="print the coupled state published on an exchange bus",
+    )
+    p.add_argument("name", help="exchange bus name")
+    p.add_argument(
+        "--timeout",
+        type=float,
+        default=60.0,
+        help="stop after this many seconds without a new step (default: 60)",
+    )
+    p.set_defaults(func=monitor)
+
+    p = subparsers.add_parser("plot", help="plot MODFLOW 6 heads")
+    p.add_argument(
+        "--head-file",
+        default="data/new_york.hds",
+        help="MODFLOW 6 head file (default: data/new_york.hds)",
+    )
+    p.add_argument(
+        "--layer",
+        type=int,
+        default=0,
+        help="zero-based layer to plot (default: 0)",
+    )
+    p.add_argument(
+        "--output",
+        default=None,
+        help="save the figure to this file instead of showing it",
+    )
+    p.set_defaults(func=plot)
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    args.func(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
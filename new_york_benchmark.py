@@ -0,0 +1,528 @@
+import argparse
+import contextlib
+import datetime
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import new_york_build_mf
+from new_york_build_mf import (
+    WetDryHysteresis,
+    _update_drain,
+    _update_ghb,
+    _update_recharge,
+    dflowfm_sequence_to_array,
+    dflowfm_to_array,
+    get_dflowfm_nodes,
+    get_mf6_bcq,
+    get_node_list,
+    set_mf6_boundaries,
+)
+from new_york_tide import tidal_stage
+
+benchmark_ws = "benchmarks"
+history_file = os.path.join(benchmark_ws, "history.json")
+baseline_file = os.path.join(benchmark_ws, "baseline.json")
+modelname = "bench"
+grid_sizes = (10, 32, 100, 316, 1000)
+regression_threshold = 0.25
+# times shorter than this are too noisy to flag as regressions
+min_regression_time = 1e-4
+sequence_steps = 10
+
+
+class FakeModelGrid:
+    """Structured grid with the intersect/get_node interface of the
+    flopy modelgrid used by dflowfm_to_array
+
+    intersect follows flopy's StructuredGrid.intersect (a comparison
+    with every row and column edge), so its cost grows with the grid
+    like flopy's does. get_modelgrid uses flopy when it is installed.
+
+    """
+
+    def __init__(self, nlay, nrow, ncol, delr=1.0, delc=1.0):
+        self.nlay, self.nrow, self.ncol = nlay, nrow, ncol
+        self.delr, self.delc = delr, delc
+        self.xoff, self.yoff = 0.0, 0.0
+        x = self.xoff + delr * (np.arange(ncol) + 0.5)
+        y = self.yoff + delc * (nrow - np.arange(nrow) - 0.5)
+        self.xcellcenters, self.ycellcenters = np.meshgrid(x, y)
+        self.xyedges = (
+            delr * np.arange(ncol + 1, dtype=float),
+            delc * np.arange(nrow, -1, -1, dtype=float),
+        )
+
+    def get_local_coords(self, x, y):
+        return x - self.xoff, y - self.yoff
+
+    def intersect(self, x, y):
+        x, y = self.get_local_coords(x, y)
+        xe, ye = self.xyedges
+        xcomp = x > xe
+        if np.all(xcomp) or not np.any(xcomp):
+            raise ValueError("x, y point given is outside of the model area")
+        j = np.where(xcomp)[0][-1]
+        ycomp = y < ye
+        if np.all(ycomp) or not np.any(ycomp):
+            raise ValueError("x, y point given is outside of the model area")
+        i = np.where(ycomp)[0][-1]
+        return i, j
+
+    def get_node(self, cellids):
+        return [
+            k * self.nrow * self.ncol + i * self.ncol + j
+            for k, i, j in cellids
+        ]
+
+
+class FakeMf6:
+    """In-memory pointer store with the modflowapi variables used by the
+    coupling functions (TOP, NBOUND, NODELIST, BOUND, and SIMVALS)
+
+    """
+
+    def __init__(self, modelname, nlay, nrow, ncol, top):
+        nodes = nlay * nrow * ncol
+        maxbound = nrow * ncol
+        model = modelname.upper()
+        top = np.resize(np.asarray(top, dtype=float), nodes)
+        self.values = {
+            f"{model}/DIS/TOP": top,
+            "SLN_1/IOUTTOT_TIMESTEP": np.ones(1, dtype=np.int32),
+            "SLN_1/ITERTOT_TIMESTEP": np.ones(1, dtype=np.int32),
+        }
+        packages = (("RCH_0", 1), ("DRN_0", 2), ("GHB_0", 2))
+        for packagename, ncolumns in packages:
+            path = f"{model}/{packagename}"
+            self.values[f"{path}/NBOUND"] = np.zeros(1, dtype=np.int32)
+            self.values[f"{path}/NODELIST"] = np.zeros(
+                maxbound,
+                dtype=np.int32,
+            )
+            self.values[f"{path}/BOUND"] = np.zeros(
+                (maxbound, ncolumns),
+                dtype=float,
+            )
+            self.values[f"{path}/SIMVALS"] = np.zeros(maxbound, dtype=float)
+
+    def get_var_address(
+        self,
+        var_name,
+        component_name,
+        subcomponent_name="",
+    ):
+        parts = [component_name.upper()]
+        if subcomponent_name:
+            parts.append(subcomponent_name.upper())
+        parts.append(var_name.upper())
+        return "/".join(parts)
+
+    def get_value_ptr(self, address):
+        return self.values[address]
+
+    def get_value(self, address):
+        return self.values[address].copy()
+
+    def set_value(self, address, value):
+        self.values[address][:] = value
+
+    def get_current_time(self):
+        return 0.0
+
+
+@contextlib.contextmanager
+def grid_dimensions(nlay, nrow, ncol):
+    """Temporarily change the model dimensions used by
+    new_york_build_mf
+
+    """
+    get_dimensions = new_york_build_mf.get_dimensions
+    new_york_build_mf.get_dimensions = lambda: (nlay, nrow, ncol)
+    try:
+        yield
+    finally:
+        new_york_build_mf.get_dimensions = get_dimensions
+
+
+def get_modelgrid(nlay, nrow, ncol):
+    """Return a flopy StructuredGrid with unit cells, or a FakeModelGrid
+    if flopy is not installed
+
+    """
+    try:
+        from flopy.discretization import StructuredGrid
+    except ImportError:
+        return FakeModelGrid(nlay, nrow, ncol)
+    return StructuredGrid(
+        delc=np.ones(nrow, dtype=float),
+        delr=np.ones(ncol, dtype=float),
+        nlay=nlay,
+    )
+
+
+def make_case(side, nlay=2):
+    """Return a synthetic mesh, MODFLOW 6 pointer store, and water levels
+    for a side x side grid with a sloping bed
+
+    """
+    nrow = ncol = side
+    modelgrid = get_modelgrid(nlay, nrow, ncol)
+    x = modelgrid.xcellcenters.ravel()
+    y = modelgrid.ycellcenters.ravel()
+    top = np.tile(np.linspace(-5.0, 5.0, ncol), nrow)
+    mf6 = FakeMf6(modelname, nlay, nrow, ncol, top)
+
+    time = 300.0 * np.arange(1, sequence_steps + 1)
+    stage = tidal_stage(time)[:, 0]
+    water_level = np.maximum(stage[:, np.newaxis], top[np.newaxis, :])
+    water_depth = water_level - top[np.newaxis, :]
+    return {
+        "nlay": nlay,
+        "nrow": nrow,
+        "ncol": ncol,
+        "modelgrid": modelgrid,
+        "mf6": mf6,
+        "xy": list(zip(x, y)),
+        "top": top,
+        "time": time,
+        "water_level": water_level,
+        "water_depth": water_depth,
+    }
+
+
+def _fill_simvals(case):
+    for packagename in ("DRN_0", "GHB_0"):
+        address = f"{modelname.upper()}/{packagename}/SIMVALS"
+        case["mf6"].get_value_ptr(address)[:] = -1.0
+
+
+def get_benchmarks():
+    """Return the coupling hot paths as name: (setup, function) pairs.
+    setup(case) prepares the pointer store and returns the arguments.
+
+    """
+
+    def get_nodes(case):
+        # intersect is only timed by the dflowfm_to_array benchmark
+        if "nodes" not in case:
+            case["nodes"] = get_dflowfm_nodes(case["modelgrid"], case["xy"])
+        return case["nodes"]
+
+    def mapped(case):
+        nodes = get_nodes(case)
+        return (
+            dflowfm_sequence_to_array(nodes, case["water_level"])[0],
+            dflowfm_sequence_to_array(nodes, case["water_depth"])[0],
+        )
+
+    def node_list_args(packagename):
+        def setup(case):
+            water_level, water_depth = mapped(case)
+            return (
+                modelname,
+                case["mf6"],
+                packagename,
+                case["top"],
+                water_level,
+                water_depth,
+            )
+
+        return setup
+
+    def update_args(case):
+        water_level, water_depth = mapped(case)
+        return modelname, case["mf6"], case["top"], water_level, water_depth
+
+    def bcq_args(case):
+        set_mf6_boundaries(modelname, case["mf6"], *mapped(case))
+        _fill_simvals(case)
+        return modelname, case["mf6"]
+
+    def hysteresis_update(water_depth):
+        hysteresis = WetDryHysteresis(0.01, 0.001, 900.0)
+        for step in range(water_depth.shape[0]):
+            hysteresis.update(water_depth[step], time=300.0 * step)
+
+    return {
+        "dflowfm_to_array": (
+            lambda case: (
+                case["modelgrid"],
+                case["xy"],
+                case["water_level"][0],
+            ),
+            dflowfm_to_array,
+        ),
+        "dflowfm_sequence_to_array": (
+            lambda case: (
+                get_nodes(case),
+                case["water_level"],
+            ),
+            dflowfm_sequence_to_array,
+        ),
+        "get_node_list_ghb": (node_list_args("GHB_0"), get_node_list),
+        "get_node_list_drn": (node_list_args("DRN_0"), get_node_list),
+        "_update_recharge": (update_args, _update_recharge),
+        "_update_drain": (update_args, _update_drain),
+        "_update_ghb": (update_args, _update_ghb),
+        "set_mf6_boundaries": (
+            lambda case: (modelname, case["mf6"], *mapped(case)),
+            set_mf6_boundaries,
+        ),
+        "get_mf6_bcq": (bcq_args, get_mf6_bcq),
+        "WetDryHysteresis.update": (
+            lambda case: (case["water_depth"],),
+            hysteresis_update,
+        ),
+    }
+
+
+def get_builder_benchmarks():
+    """Return the model builders that can be run in this environment"""
+    builders = {}
+    try:
+        import flopy  # noqa: F401
+
+        from new_york_build_mf import build_mf6
+
+        def run_build_mf6(modelws):
+            # cell centers of the D-FLOW FM mesh and boundary cells
+            x, y = np.meshgrid(
+                np.arange(-5.5, 5.0),
+                np.arange(4.5, -5.0, -1.0),
+            )
+            z = -5.0 + x + 5.5
+            xyz = np.column_stack((x.ravel(), y.ravel(), z.ravel()))
+            build_mf6(modelws, transient=True, xyz=xyz, clean=True)
+
+        builders["build_mf6"] = run_build_mf6
+    except ImportError:
+        pass
+    try:
+        import hydrolib.core  # noqa: F401
+
+        from new_york_build_dflow import build_dflowfm
+
+        builders["build_dflowfm"] = lambda modelws: build_dflowfm(
+            modelws,
+            clean=True,
+        )
+    except ImportError:
+        pass
+    return builders
+
+
+def measure(function, args, repeat):
+    """Return the fastest wall time and the peak traced memory"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        function(*args)
+        times.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return min(times), peak
+
+
+def run_benchmarks(
+    sizes=grid_sizes,
+    max_cells=None,
+    repeat=3,
+    names=None,
+    builders=True,
+    verbose=False,
+):
+    results = {}
+    for side in sizes:
+        ncells = side * side
+        if max_cells is not None and ncells > max_cells:
+            continue
+        case = make_case(side)
+        with grid_dimensions(case["nlay"], case["nrow"], case["ncol"]):
+            for name, (setup, function) in get_benchmarks().items():
+                if names is not None and name not in names:
+                    continue
+                args = setup(case)
+                # large grids are only timed once
+                nrepeat = repeat if ncells <= 100_000 else 1
+                elapsed, peak = measure(function, args, nrepeat)
+                results.setdefault(name, {})[str(ncells)] = {
+                    "time": elapsed,
+                    "peak_memory": peak,
+                }
+                if verbose:
+                    print(
+                        f"{name:<28s} {ncells:>9d} cells "
+                        + f"{elapsed:10.6f} s {peak / 1024**2:9.3f} MiB"
+                    )
+
+    if builders:
+        for name, builder in get_builder_benchmarks().items():
+            if names is not None and name not in names:
+                continue
+            with tempfile.TemporaryDirectory() as tmpdir:
+                modelws = os.path.join(tmpdir, "model")
+                elapsed, peak = measure(builder, (modelws,), repeat)
+            ncells = int(np.prod(new_york_build_mf.get_shapes()[0]))
+            results.setdefault(name, {})[str(ncells)] = {
+                "time": elapsed,
+                "peak_memory": peak,
+            }
+            if verbose:
+                print(
+                    f"{name:<28s} {ncells:>9d} cells "
+                    + f"{elapsed:10.6f} s {peak / 1024**2:9.3f} MiB"
+                )
+    return results
+
+
+def get_run_record(results):
+    return {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "modelgrid": type(get_modelgrid(1, 1, 1)).__name__,
+        "results": results,
+    }
+
+
+def append_history(record, file_path=history_file):
+    history = []
+    if os.path.isfile(file_path):
+        with open(file_path) as f:
+            history = json.load(f)
+    history.append(record)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w") as f:
+        json.dump(history, f, indent=2)
+    return
+
+
+def compare(results, baseline, threshold=regression_threshold):
+    """Return the benchmarks that are slower, or use more memory, than
+    the baseline by more than threshold (a fraction)
+
+    """
+    regressions = []
+    for name, sizes in results.items():
+        for ncells, result in sizes.items():
+            reference = baseline.get(name, {}).get(ncells)
+            if reference is None:
+                continue
+            for key in ("time", "peak_memory"):
+                if reference[key] <= 0:
+                    continue
+                if key == "time" and result[key] < min_regression_time:
+                    continue
+                ratio = result[key] / reference[key]
+                if ratio > 1.0 + threshold:
+                    regressions.append(
+                        {
+                            "name": name,
+                            "cells": int(ncells),
+                            "metric": key,
+                            "baseline": reference[key],
+                            "current": result[key],
+                            "ratio": ratio,
+                        }
+                    )
+    return regressions
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(
+        description="Benchmark the coupling hot paths on synthetic grids",
+    )
+    parser.add_argument(
+        "--max-cells",
+        type=int,
+        default=None,
+        help="largest grid (number of cells) to benchmark",
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--only",
+        nargs="+",
+        default=None,
+        help="names of the benchmarks to run",
+    )
+    parser.add_argument(
+        "--no-builders",
+        action="store_true",
+        help="do not benchmark build_mf6 and build_dflowfm",
+    )
+    parser.add_argument(
+        "--baseline",
+        default=baseline_file,
+        help=f"baseline results (default: {baseline_file})",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="save these results as the baseline",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=regression_threshold,
+        help="allowed slowdown as a fraction of the baseline "
+        + f"(default: {regression_threshold})",
+    )
+    return parser
+
+
+def main(argv=None):
+    args = get_parser().parse_args(argv)
+    results = run_benchmarks(
+        max_cells=args.max_cells,
+        repeat=args.repeat,
+        names=args.only,
+        builders=not args.no_builders,
+        verbose=True,
+    )
+    record = get_run_record(results)
+    append_history(record)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w") as f:
+            json.dump(record, f, indent=2)
+        print(f"saved baseline {args.baseline}")
+        return 0
+
+    if not os.path.isfile(args.baseline):
+        print(f"no baseline {args.baseline}, run with --save-baseline")
+        return 0
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("modelgrid") != record["modelgrid"]:
+        print(
+            f"the baseline used {baseline.get('modelgrid')} and this run "
+            + f"used {record['modelgrid']}, so the dflowfm_to_array "
+            + "times are not comparable"
+        )
+    regressions = compare(results, baseline["results"], args.threshold)
+    for regression in regressions:
+        print(
+            f"REGRESSION {regression['name']} "
+            + f"({regression['cells']} cells) {regression['metric']}: "
+            + f"{regression['baseline']:.6g} -> {regression['current']:.6g} "
+            + f"({regression['ratio']:.2f}x)"
+        )
+    if regressions:
+        return 1
+    print(f"no regressions beyond {args.threshold:.0%} of the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,26 +3,23 @@ import shutil
 from pathlib import Path
 
 import numpy as np
-from hydrolib.core.io.bc.models import (
-    Astronomic,
-    ForcingModel,
-    QuantityUnitPair,
-)
-from hydrolib.core.io.ext.models import Boundary, ExtModel
-from hydrolib.core.io.inifield.models import (
-    DataFileType,
-    IniFieldModel,
-    InitialField,
-    InterpolationMethod,
+
+from new_york_tide import (
+    astronomic_forcing,
+    cached_tidal_stage,
+    read_pli_names,
+    tide_cache_dir,
+    timeseries_forcing,
 )
-from hydrolib.core.io.mdu.models import FMModel
-from hydrolib.core.io.xyz.models import XYZModel, XYZPoint
 
 extent = (-5.0, -5.0, 5.0, 5.0)
 dx, dy = 1.0, 1.0
+boundary_pli = os.path.join("initial_files", "Boundary01.pli")
 
 
 def generate_bed_level(z0=-5, dz=10.0, verbose=False):
+    from hydrolib.core.io.xyz.models import XYZPoint
+
     slope = dz / (extent[2] - extent[0] - dx)
     points = []
     xref = extent[0] + 0.5 * dx
@@ -44,8 +41,16 @@ def build_dflowfm(
     modelws,
     modelname="model",
     clean=False,
+    constituents=None,
+    forcing="astronomic",
+    tstop=None,
     verbose=False,
 ):
+    if forcing not in ("astronomic", "timeseries"):
+        raise ValueError(f"unknown boundary forcing: {forcing}")
+    boundary_names = read_pli_names(boundary_pli)
+    cache_dir = os.path.abspath(tide_cache_dir)
+
     # Initialize model dir
     if clean:
         if Path(modelws).exists():
@@ -54,7 +59,44 @@ def build_dflowfm(
     else:
         os.makedirs(modelws, exist_ok=True)
 
+    # hydrolib writes the model files relative to the working directory
+    cwd = os.getcwd()
     os.chdir(modelws)
+    try:
+        _write_dflowfm(
+            modelname,
+            boundary_names,
+            constituents=constituents,
+            forcing=forcing,
+            tstop=tstop,
+            cache_dir=cache_dir,
+            verbose=verbose,
+        )
+    finally:
+        os.chdir(cwd)
+
+    return
+
+
+def _write_dflowfm(
+    modelname,
+    boundary_names,
+    constituents=None,
+    forcing="astronomic",
+    tstop=None,
+    cache_dir=tide_cache_dir,
+    verbose=False,
+):
+    from hydrolib.core.io.bc.models import ForcingModel
+    from hydrolib.core.io.ext.models import Boundary, ExtModel
+    from hydrolib.core.io.inifield.models import (
+        DataFileType,
+        IniFieldModel,
+        InitialField,
+        InterpolationMethod,
+    )
+    from hydrolib.core.io.mdu.models import FMModel
+    from hydrolib.core.io.xyz.models import XYZModel
 
     # Create new model object
     fm_model = FMModel()
@@ -79,32 +121,40 @@ def build_dflowfm(
     )
     fm_model.geometry.inifieldfile = IniFieldModel(initial=[bed_level])
 
-    # Create boundary
-    forcing_1 = Astronomic(
-        name="Boundary01_0001",
-        quantityunitpair=[
-            QuantityUnitPair(quantity="astronomic component", unit="-"),
-            QuantityUnitPair(quantity="waterlevelbnd amplitude", unit="m"),
-            QuantityUnitPair(quantity="waterlevelbnd phase", unit="deg"),
-        ],
-        datablock=[
-            ["A0", "0.5", "0"],
-            ["M2", "2", "0"],
-        ],
+    fm_model.time.dtuser = 300.0
+    fm_model.output.mapinterval = [300.0]
+    if tstop is not None:
+        fm_model.time.tstop = tstop
+
+    # Create boundary forcing, both forms are written and the boundary
+    # uses the one selected by forcing
+    time = np.arange(
+        fm_model.time.tstart,
+        fm_model.time.tstop + fm_model.time.dtuser,
+        fm_model.time.dtuser,
     )
-    forcing_2 = Astronomic(
-        name="Boundary01_0002",
-        quantityunitpair=[
-            QuantityUnitPair(quantity="astronomic component", unit="-"),
-            QuantityUnitPair(quantity="waterlevelbnd amplitude", unit="m"),
-            QuantityUnitPair(quantity="waterlevelbnd phase", unit="deg"),
-        ],
-        datablock=[
-            ["A0", "0.5", "0"],
-            ["M2", "2", "0"],
-        ],
+    stage = cached_tidal_stage(
+        time,
+        constituents=constituents,
+        npoints=len(boundary_names),
+        cache_dir=cache_dir,
     )
-    forcing_model = ForcingModel(forcing=[forcing_1, forcing_2])
+    forcings = {
+        "astronomic": astronomic_forcing(boundary_names, constituents),
+        "timeseries": timeseries_forcing(
+            boundary_names,
+            time,
+            stage,
+            refdate=fm_model.time.refdate,
+        ),
+    }
+    for form, form_forcing in forcings.items():
+        if form != forcing:
+            ForcingModel(
+                forcing=form_forcing,
+                filepath=Path(f"{modelname}_{form}.bc"),
+            ).save()
+    forcing_model = ForcingModel(forcing=forcings[forcing])
     forcing_model.save(recurse=True)
     boundary = Boundary(
         quantity="waterlevelbnd",
@@ -114,12 +164,7 @@ def build_dflowfm(
     external_forcing = ExtModel(boundary=[boundary])
     fm_model.external_forcing.extforcefilenew = external_forcing
 
-    fm_model.time.dtuser = 300.0
-    fm_model.output.mapinterval = [300.0]
-
     # Save model
     fm_model.save(recurse=True)
 
-    os.chdir("..")
-
     return
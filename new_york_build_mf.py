@@ -1,16 +1,21 @@
 import os
 import shutil
+import sys
 from pathlib import Path
 
-import flopy
 import numpy as np
-from pyexpat import model
 
 from new_york_build_dflow import dx, dy
 
 exe_dir = "mf6_dll"
-mfexe = os.path.abspath(os.path.join(exe_dir, "mf6.exe"))
-mfapiexe = os.path.abspath(os.path.join(exe_dir, "libmf6.dll"))
+if sys.platform == "win32":
+    mfexe_name, mfapiexe_name = "mf6.exe", "libmf6.dll"
+elif sys.platform == "darwin":
+    mfexe_name, mfapiexe_name = "mf6", "libmf6.dylib"
+else:
+    mfexe_name, mfapiexe_name = "mf6", "libmf6.so"
+mfexe = os.path.abspath(os.path.join(exe_dir, mfexe_name))
+mfapiexe = os.path.abspath(os.path.join(exe_dir, mfapiexe_name))
 
 
 def const_to_2darray(nrow, ncol, v):
@@ -54,6 +59,42 @@ def get_recharge_rate():
     return 3.0e-6
 
 
+def get_ims_options():
+    return {
+        "linear_acceleration": "bicgstab",
+        "outer_dvclose": 1e-6,
+        "inner_dvclose": 1e-9,
+        "outer_maximum": 500,
+        "inner_maximum": 100,
+    }
+
+
+def get_hysteresis_options():
+    """Return the WetDryHysteresis settings shared by the coupled,
+    replay, and IMS tuning runs (all zero is the strict wd > 0.0 test)
+
+    """
+    return {
+        "wet_depth": 0.0,
+        "dry_depth": 0.0,
+        "min_dwell": 0.0,
+    }
+
+
+def load_xyz(verbose=False):
+    npz_path = os.path.abspath(os.path.join("model", "xyz.npz"))
+    npzfile = np.load(npz_path)
+    xyz = np.array(
+        [
+            (xx, yy, zz)
+            for xx, yy, zz in zip(npzfile["x"], npzfile["y"], npzfile["z"])
+        ]
+    )
+    if verbose:
+        print(xyz)
+    return xyz
+
+
 def xy_from_xyz(xyz):
     return [(x, y) for x, y, _ in xyz]
 
@@ -82,6 +123,50 @@ def dflowfm_to_array(modelgrid, xy, v, two_dimensional=False):
     return arr
 
 
+def get_dflowfm_nodes(modelgrid, xy):
+    """Return the MODFLOW 6 (zero-based) layer 1 node for each D-FLOW FM
+    cell center
+
+    """
+    nodes = []
+    for x, y in xy:
+        i, j = modelgrid.intersect(x, y)
+        nodes.append(modelgrid.get_node([(0, i, j)])[0])
+    return np.array(nodes, dtype=int)
+
+
+def dflowfm_sequence_to_array(nodes, v, fill_nodes=None):
+    """Map a (nsteps, ncells) sequence of D-FLOW FM cell values to a
+    (nsteps, nrow * ncol) MODFLOW 6 array in one pass
+
+    nodes is returned by get_dflowfm_nodes. fill_nodes optionally maps
+    every MODFLOW 6 node to the node it takes its value from and is
+    used to fill nodes without a D-FLOW FM cell.
+
+    """
+    v = np.asarray(v, dtype=float)
+    shape1d, _ = get_sizes()
+    arr = np.full((v.shape[0], shape1d), 1e30, dtype=float)
+    arr[:, nodes] = v
+    if fill_nodes is not None:
+        arr = arr[:, fill_nodes]
+    return arr
+
+
+def get_fill_nodes(modelgrid, nodes):
+    """Return the nearest node with a D-FLOW FM cell for every
+    MODFLOW 6 layer 1 node
+
+    """
+    xc = np.asarray(modelgrid.xcellcenters, dtype=float).ravel()
+    yc = np.asarray(modelgrid.ycellcenters, dtype=float).ravel()
+    mapped = np.unique(nodes)
+    dist = (xc[:, np.newaxis] - xc[np.newaxis, mapped]) ** 2 + (
+        yc[:, np.newaxis] - yc[np.newaxis, mapped]
+    ) ** 2
+    return mapped[np.argmin(dist, axis=1)]
+
+
 def rch_boundary(nrow, ncol, top, recharge_rate, head=0.0):
     head = const_to_2darray(nrow, ncol, head)
     stress_period_data = []
@@ -118,6 +203,94 @@ def update_nbound(modelname, mf6, packagename, nbound):
     mf6.set_value(nbound_tag, np.array([nbound], dtype=np.int32))
 
 
+class WetDryHysteresis:
+    """Wet/dry state of the MODFLOW 6 boundary cells with hysteresis
+
+    A dry cell becomes wet when the water depth exceeds wet_depth and a
+    wet cell becomes dry when the water depth drops to dry_depth or
+    below. A cell is not switched again until min_dwell (model time
+    units) has passed since its last switch. The default thresholds
+    reproduce the strict wd > 0.0 test.
+
+    """
+
+    def __init__(self, wet_depth=0.0, dry_depth=0.0, min_dwell=0.0):
+        if dry_depth > wet_depth:
+            raise ValueError(
+                f"dry_depth ({dry_depth}) must not exceed "
+                + f"wet_depth ({wet_depth})"
+            )
+        self.wet_depth = wet_depth
+        self.dry_depth = dry_depth
+        self.min_dwell = min_dwell
+        self.wet = None
+        self.last_switch = None
+        self.switches = []
+        self.outer_iterations = []
+        self.inner_iterations = []
+
+    def update(self, water_depth, time=0.0):
+        water_depth = np.asarray(water_depth, dtype=float)
+        if self.wet is None:
+            self.wet = water_depth > self.wet_depth
+            self.last_switch = np.full(self.wet.shape, -np.inf, dtype=float)
+            self.switches.append(0)
+            return self.wet
+
+        can_switch = (time - self.last_switch) >= self.min_dwell
+        wetting = ~self.wet & (water_depth > self.wet_depth) & can_switch
+        drying = self.wet & (water_depth <= self.dry_depth) & can_switch
+        switched = wetting | drying
+        self.wet = self.wet ^ switched
+        self.last_switch[switched] = time
+        self.switches.append(int(np.count_nonzero(switched)))
+        return self.wet
+
+    def record_iterations(self, mf6, solution_id=1):
+        outer, inner = get_mf6_iterations(mf6, solution_id=solution_id)
+        self.outer_iterations.append(outer)
+        self.inner_iterations.append(inner)
+        return outer, inner
+
+    def statistics(self):
+        switches = np.array(self.switches, dtype=int)
+        outer = np.array(self.outer_iterations, dtype=int)
+        inner = np.array(self.inner_iterations, dtype=int)
+        return {
+            "wet_depth": self.wet_depth,
+            "dry_depth": self.dry_depth,
+            "min_dwell": self.min_dwell,
+            "steps": int(switches.shape[0]),
+            "total_switches": int(switches.sum()),
+            "max_switches": int(switches.max()) if switches.size else 0,
+            "total_outer_iterations": int(outer.sum()),
+            "mean_outer_iterations": _mean_or_zero(outer),
+            "total_inner_iterations": int(inner.sum()),
+            "mean_inner_iterations": _mean_or_zero(inner),
+        }
+
+
+def _mean_or_zero(v):
+    if v.size == 0:
+        return 0.0
+    return float(v.mean())
+
+
+def get_mf6_iterations(mf6, solution_id=1):
+    """Return the outer and inner iterations used by the MODFLOW 6
+    numerical solution in the last time step
+
+    """
+    solution = f"SLN_{solution_id}"
+    outer = mf6.get_value(
+        mf6.get_var_address("IOUTTOT_TIMESTEP", solution)
+    )[0]
+    inner = mf6.get_value(
+        mf6.get_var_address("ITERTOT_TIMESTEP", solution)
+    )[0]
+    return int(outer), int(inner)
+
+
 def get_node_list(
     modelname,
     mf6,
@@ -125,14 +298,14 @@ def get_node_list(
     top,
     water_level,
     water_depth,
+    wet=None,
 ):
+    if wet is None:
+        wet = np.asarray(water_depth) > 0.0
     node_list = []
     elev = []
-    for node, (wl, wd, tp) in enumerate(zip(water_level, water_depth, top)):
-        if wd > 0.0:
-            dry = False
-        else:
-            dry = True
+    for node, (wl, wt, tp) in enumerate(zip(water_level, wet, top)):
+        dry = not wt
         add_node = False
         if "GHB" in packagename.upper():
             if not dry:
@@ -168,6 +341,8 @@ def _update_recharge(
     top,
     water_level,
     water_depth,
+    wet=None,
+    recharge_rate=None,
 ):
     packagename = "RCH_0"
     nbound, node_list, _ = get_node_list(
@@ -177,15 +352,18 @@ def _update_recharge(
         top,
         water_level,
         water_depth,
+        wet=wet,
     )
 
     nodelist_array = get_nodelist_ptr(modelname, mf6, packagename)
     nodelist_array[:nbound] = node_list + 1
 
     bound_array = get_bound_ptr(modelname, mf6, packagename)
+    if recharge_rate is None:
+        recharge_rate = get_recharge_rate()
     bound_array[:nbound, 0] = np.full(
         nbound,
-        get_recharge_rate(),
+        recharge_rate,
         dtype=float,
     )
 
@@ -198,6 +376,8 @@ def _update_drain(
     top,
     water_level,
     water_depth,
+    wet=None,
+    conductance=None,
 ):
     packagename = "DRN_0"
     nbound, node_list, elev = get_node_list(
@@ -207,16 +387,19 @@ def _update_drain(
         top,
         water_level,
         water_depth,
+        wet=wet,
     )
 
     nodelist_array = get_nodelist_ptr(modelname, mf6, packagename)
     nodelist_array[:nbound] = node_list + 1
 
     bound_array = get_bound_ptr(modelname, mf6, packagename)
+    if conductance is None:
+        conductance = get_boundary_conductance()
     bound_array[:nbound, 0] = elev[:]
     bound_array[:nbound, 1] = np.full(
         nbound,
-        get_boundary_conductance(),
+        conductance,
         dtype=float,
     )
 
@@ -229,6 +412,8 @@ def _update_ghb(
     top,
     water_level,
     water_depth,
+    wet=None,
+    conductance=None,
 ):
     packagename = "GHB_0"
     nbound, node_list, elev = get_node_list(
@@ -238,27 +423,72 @@ def _update_ghb(
         top,
         water_level,
         water_depth,
+        wet=wet,
     )
 
     nodelist_array = get_nodelist_ptr(modelname, mf6, packagename)
     nodelist_array[:nbound] = node_list + 1
 
     bound_array = get_bound_ptr(modelname, mf6, packagename)
+    if conductance is None:
+        conductance = get_boundary_conductance()
     bound_array[:nbound, 0] = elev[:]
     bound_array[:nbound, 1] = np.full(
         nbound,
-        get_boundary_conductance(),
+        conductance,
         dtype=float,
     )
 
     return
 
 
-def update_mf6(modelname, modelgrid, mf6, xy, water_level, water_depth):
-    shape1d, _ = get_sizes()
-    top = mf6.get_value(mf6.get_var_address("TOP", modelname, "DIS"))[:shape1d]
+def update_mf6(
+    modelname,
+    modelgrid,
+    mf6,
+    xy,
+    water_level,
+    water_depth,
+    hysteresis=None,
+    recharge_rate=None,
+    conductance=None,
+):
     water_level = dflowfm_to_array(modelgrid, xy, water_level)
     water_depth = dflowfm_to_array(modelgrid, xy, water_depth)
+    set_mf6_boundaries(
+        modelname,
+        mf6,
+        water_level,
+        water_depth,
+        hysteresis=hysteresis,
+        recharge_rate=recharge_rate,
+        conductance=conductance,
+    )
+    return
+
+
+def set_mf6_boundaries(
+    modelname,
+    mf6,
+    water_level,
+    water_depth,
+    hysteresis=None,
+    recharge_rate=None,
+    conductance=None,
+):
+    """Update RCH, DRN, and GHB using water levels and depths that
+    have already been mapped to the MODFLOW 6 grid (dflowfm_to_array)
+
+    """
+    shape1d, _ = get_sizes()
+    top = mf6.get_value(mf6.get_var_address("TOP", modelname, "DIS"))[:shape1d]
+
+    # the same wet/dry state is used for all three packages so that
+    # every cell is in exactly one of RCH/DRN or GHB
+    if hysteresis is None:
+        wet = water_depth > 0.0
+    else:
+        wet = hysteresis.update(water_depth, time=mf6.get_current_time())
 
     _update_recharge(
         modelname,
@@ -266,6 +496,8 @@ def update_mf6(modelname, modelgrid, mf6, xy, water_level, water_depth):
         top,
         water_level,
         water_depth,
+        wet=wet,
+        recharge_rate=recharge_rate,
     )
     _update_drain(
         modelname,
@@ -273,6 +505,8 @@ def update_mf6(modelname, modelgrid, mf6, xy, water_level, water_depth):
         top,
         water_level,
         water_depth,
+        wet=wet,
+        conductance=conductance,
     )
     _update_ghb(
         modelname,
@@ -280,6 +514,8 @@ def update_mf6(modelname, modelgrid, mf6, xy, water_level, water_depth):
         top,
         water_level,
         water_depth,
+        wet=wet,
+        conductance=conductance,
     )
     return
 
@@ -289,15 +525,24 @@ def get_mf6_bcq(
     mf6,
     drn_packagename="DRN_0",
     ghb_packagename="GHB_0",
+    out=None,
 ):
     """Return drain and ghb volumetric flow rate as
     two dimensional arrays
 
+    out is an optional (drn_q, ghb_q) pair of one dimensional arrays
+    with nrow * ncol values that are filled instead of new arrays.
+
     """
     _, nrow, ncol = get_dimensions()
     shape2d = (ncol, nrow)
-    drn_q = np.full(ncol * nrow, 1e30, dtype=float)
-    ghb_q = np.full(ncol * nrow, 1e30, dtype=float)
+    if out is None:
+        drn_q = np.full(ncol * nrow, 1e30, dtype=float)
+        ghb_q = np.full(ncol * nrow, 1e30, dtype=float)
+    else:
+        drn_q, ghb_q = out
+        drn_q.fill(1e30)
+        ghb_q.fill(1e30)
 
     nbound = mf6.get_value(
         mf6.get_var_address("NBOUND", modelname, drn_packagename)
@@ -328,8 +573,17 @@ def build_mf6(
     xyz=None,
     clean=False,
     solver_print="SUMMARY",
+    ims_options=None,
+    newtonoptions="NEWTON UNDER_RELAXATION",
+    k=None,
+    k33=None,
+    recharge=None,
+    conductance=None,
+    sim_length=86400.0,
+    dt=300.0,
     verbose=False,
 ):
+    import flopy
 
     if clean:
         if Path(modelws).exists():
@@ -339,16 +593,7 @@ def build_mf6(
         os.makedirs(modelws, exist_ok=True)
 
     if xyz is None:
-        npz_path = os.path.abspath(os.path.join("model", "xyz.npz"))
-        npzfile = np.load(npz_path)
-        xyz = np.array(
-            [
-                (xx, yy, zz)
-                for xx, yy, zz in zip(npzfile["x"], npzfile["y"], npzfile["z"])
-            ]
-        )
-        if verbose:
-            print(xyz)
+        xyz = load_xyz(verbose=verbose)
 
     xy = xy_from_xyz(xyz)
     z = z_from_xyz(xyz)
@@ -361,11 +606,9 @@ def build_mf6(
 
     nper = 1
     if transient:
-        sim_length = 86400.0
-        dt = 300.0
         nsteps = int(sim_length / dt)
         period_data = [
-            (86400.0, nsteps, 1.0),
+            (sim_length, nsteps, 1.0),
         ]
     else:
         period_data = [
@@ -401,11 +644,18 @@ def build_mf6(
         dz_mf *= 1.5
         botm[k, :, :] = botm[k - 1, :, :] - dz_mf
 
-    k, k33 = get_hydraulic_conductivity()
+    default_k, default_k33 = get_hydraulic_conductivity()
+    if k is None:
+        k = default_k
+    if k33 is None:
+        k33 = default_k33
     sy = 0.2
     ss = 1e-5
-    recharge = get_recharge_rate()
-    ghb_cond = get_boundary_conductance()
+    if recharge is None:
+        recharge = get_recharge_rate()
+    ghb_cond = conductance
+    if ghb_cond is None:
+        ghb_cond = get_boundary_conductance()
 
     sim = flopy.mf6.MFSimulation(
         sim_name=modelname,
@@ -418,14 +668,12 @@ def build_mf6(
         time_units="seconds",
         perioddata=period_data,
     )
+    if ims_options is None:
+        ims_options = get_ims_options()
     ims = flopy.mf6.ModflowIms(
         sim,
-        linear_acceleration="bicgstab",
         print_option=solver_print,
-        outer_dvclose=1e-6,
-        inner_dvclose=1e-9,
-        outer_maximum=500,
-        inner_maximum=100,
+        **ims_options,
     )
 
     gwf = flopy.mf6.ModflowGwf(
@@ -433,7 +681,7 @@ def build_mf6(
         modelname=modelname,
         print_input=False,
         save_flows=True,
-        newtonoptions="NEWTON UNDER_RELAXATION",
+        newtonoptions=newtonoptions,
     )
 
     dis = flopy.mf6.ModflowGwfdis(
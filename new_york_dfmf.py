@@ -1,112 +1,256 @@
 import os
-from distutils.dir_util import copy_tree
+import sys
 from pathlib import Path
 
-import flopy
-import matplotlib.pyplot as plt
-import numpy as np
-from bmi.wrapper import BMIWrapper
-from modflowapi import ModflowApi
-
-from new_york_build_dflow import build_dflowfm, dx, dy, extent
-from new_york_build_mf import build_mf6, get_mf6_bcq, mfapiexe, update_mf6
+from new_york_build_mf import (
+    WetDryHysteresis,
+    build_mf6,
+    get_dflowfm_nodes,
+    get_fill_nodes,
+    get_hysteresis_options,
+    get_mf6_bcq,
+    get_sizes,
+    mfapiexe,
+    set_mf6_boundaries,
+)
+from new_york_exchange import save_exchange_recording
+from new_york_workspace import provision_workspace
 
 verbose = False
-
-# build dflowfm model
 modelname = "model_dfmf"
 modelws = "model_dfmf"
-build_dflowfm(
-    modelws,
-    modelname=modelname,
-    clean=True,
-    verbose=verbose,
-)
 
-# build mf6 model
-file_path = "data/new_york.hds"
-strt = flopy.utils.HeadFile(file_path).get_data()
-sim = build_mf6(
-    modelws,
-    modelname=modelname,
-    transient=True,
-    strt=strt,
-    xyz=None,
-    verbose=verbose,
-)
-gwf = sim.get_model()
+# wet/dry hysteresis for switching cells between RCH/DRN and GHB
+# (wet_depth, dry_depth, and min_dwell), shared with the replay and
+# IMS tuning runs
+hysteresis_options = get_hysteresis_options()
 
-# Add dflowfm dll folder to PATH so that it can be found by the BMIWrapper
-os.environ["PATH"] = (
-    str(Path().cwd() / "dflowfm_dll") + os.pathsep + os.environ["PATH"]
-)
+# save the D-FLOW FM stage and depth sequence for MODFLOW 6 only runs
+record_exchange = False
 
+# run length, in seconds, of both D-FLOW FM (tstop) and MODFLOW 6
+sim_length = 86400.0
 
-# We workaround
-# - https://github.com/Deltares/HYDROLIB-core/issues/295 and
-# - https://github.com/Deltares/HYDROLIB-core/issues/290
-# by creating these files ourselves and then copying them
-copy_tree("initial_files", modelname)
+# boundary forcing, "astronomic" or "timeseries"; use "timeseries" when
+# the recorded exchange is compared with the surrogate recording used
+# by the IMS tuning and emulator scripts
+forcing = "astronomic"
 
-# Initialize the BMI Wrapper
-dflowfm = BMIWrapper(
-    engine="dflowfm",
-    configfile=os.path.abspath(f"{modelws}/{modelname}.mdu"),
-)
-dflowfm.initialize()
+# use the linear-response emulator (python new_york_surrogate.py)
+# instead of MODFLOW 6
+use_emulator = False
+emulator_path = os.path.join("model_surrogate", "emulator.npz")
 
-x = dflowfm.get_var("xz")
-y = dflowfm.get_var("yz")
-z = dflowfm.get_var("bl")
-xy = [(xx, yy) for (xx, yy) in zip(x, y)]
+# publish the coupled state every step on a shared-memory exchange bus
+# with this name (python new_york_exchange_bus.py <name> to monitor it)
+exchange_bus_name = None
 
 
-# create MODFLOW 6 model instance
-mf6_config_file = os.path.join(modelws, "mfsim.nam")
-mf6 = ModflowApi(mfapiexe)
+def main(
+    record_exchange=record_exchange,
+    use_emulator=use_emulator,
+    exchange_bus_name=exchange_bus_name,
+    hysteresis_options=hysteresis_options,
+    sim_length=sim_length,
+    forcing=forcing,
+    verbose=verbose,
+):
+    import flopy
+    import numpy as np
+    from bmi.wrapper import BMIWrapper
 
-# initialize the MODFLOW 6 model
-mf6.initialize(mf6_config_file)
+    # provision the dflowfm model workspace from the template
+    provision_workspace(
+        modelws,
+        modelname=modelname,
+        build_kwargs={"tstop": sim_length, "forcing": forcing},
+        verbose=True,
+    )
 
+    # build mf6 model
+    file_path = "data/new_york.hds"
+    strt = flopy.utils.HeadFile(file_path).get_data()
+    sim = build_mf6(
+        modelws,
+        modelname=modelname,
+        transient=True,
+        strt=strt,
+        xyz=None,
+        verbose=verbose,
+        sim_length=sim_length,
+    )
+    gwf = sim.get_model()
 
-print(
-    f"MF current_time: {mf6.get_current_time()}, "
-    + f"DFLOWFM current_time: {dflowfm.get_current_time()}"
-)
-print(
-    f"MF end_time: {mf6.get_end_time()}, "
-    + f"DFLOWFM end_time: {dflowfm.get_end_time()}"
-)
+    # Add dflowfm dll folder to PATH so that it can be found by the BMIWrapper
+    os.environ["PATH"] = (
+        str(Path().cwd() / "dflowfm_dll") + os.pathsep + os.environ["PATH"]
+    )
 
-# Time loop
-while dflowfm.get_current_time() < dflowfm.get_end_time():
-    dflowfm.update()
-
-    water_level = dflowfm.get_var("s1")
-    water_depth = dflowfm.get_var("hs")
-    update_mf6(
-        modelname,
-        gwf.modelgrid,
-        mf6,
-        xy,
-        water_level,
-        water_depth,
+    # Initialize the BMI Wrapper
+    dflowfm = BMIWrapper(
+        engine="dflowfm",
+        configfile=os.path.abspath(f"{modelws}/{modelname}.mdu"),
     )
-    mf6.update()
-
-    # get the volumetric drain and ghb fluxes
-    # these could be provided as a source or sink
-    # of water for D-FLOW FM. A negative value
-    # would be a source of water to D-FLOW FM.
-    # A positive value would be a loss of water
-    # from D-FLOW FM. Drain volumetric fluxes will
-    # always be a source of water to D-FLOW FM.
-    drn_q, ghb_q = get_mf6_bcq(modelname, mf6)
-
-# Finalize
-dflowfm.finalize()
-mf6.finalize()
-
-# to print the final drn_q and ghb_q array data
-# print(len(drn_q[drn_q != 1e30]), drn_q.shape, drn_q)
-# print(len(ghb_q[ghb_q != 1e30]), ghb_q.shape, ghb_q)
+    dflowfm.initialize()
+
+    x = dflowfm.get_var("xz")
+    y = dflowfm.get_var("yz")
+    z = dflowfm.get_var("bl")
+    xy = [(xx, yy) for (xx, yy) in zip(x, y)]
+
+    # MODFLOW 6 node of each D-FLOW FM cell and the mapped values
+    nodes = get_dflowfm_nodes(gwf.modelgrid, xy)
+    shape1d, _ = get_sizes()
+    level_mf = np.full(shape1d, 1e30, dtype=float)
+    depth_mf = np.full(shape1d, 1e30, dtype=float)
+    bcq_out = None
+
+    bus = None
+    if exchange_bus_name is not None:
+        from new_york_exchange_bus import ExchangeBus
+
+        bus = ExchangeBus.create(exchange_bus_name, shape1d)
+        print(f"publishing the coupled state on exchange bus {bus.name}")
+
+    drn_q = ghb_q = None
+    try:
+        if use_emulator:
+            from new_york_surrogate import LinearResponseEmulator
+
+            # the emulator needs a value in every cell, so cells without a
+            # D-FLOW FM cell use the nearest one (as in remap_sequence)
+            fill_nodes = np.arange(shape1d)
+            if np.unique(nodes).shape[0] < shape1d:
+                fill_nodes = get_fill_nodes(gwf.modelgrid, nodes)
+
+            # create and initialize the MODFLOW 6 emulator
+            mf6 = LinearResponseEmulator.load(emulator_path)
+            mf6.initialize()
+        else:
+            from modflowapi import ModflowApi
+
+            # create MODFLOW 6 model instance
+            mf6_config_file = os.path.join(modelws, "mfsim.nam")
+            mf6 = ModflowApi(mfapiexe)
+
+            # initialize the MODFLOW 6 model
+            mf6.initialize(mf6_config_file)
+
+        print(
+            f"MF current_time: {mf6.get_current_time()}, "
+            + f"DFLOWFM current_time: {dflowfm.get_current_time()}"
+        )
+        print(
+            f"MF end_time: {mf6.get_end_time()}, "
+            + f"DFLOWFM end_time: {dflowfm.get_end_time()}"
+        )
+        if not np.isclose(mf6.get_end_time(), dflowfm.get_end_time()):
+            raise ValueError(
+                f"MODFLOW 6 ends at {mf6.get_end_time()} but D-FLOW FM "
+                + f"ends at {dflowfm.get_end_time()}; set the run length "
+                + "with sim_length"
+            )
+
+        hysteresis = WetDryHysteresis(**hysteresis_options)
+
+        times, water_levels, water_depths = [], [], []
+
+        # Time loop
+        while dflowfm.get_current_time() < dflowfm.get_end_time():
+            dflowfm.update()
+
+            water_level = dflowfm.get_var("s1")
+            water_depth = dflowfm.get_var("hs")
+            if record_exchange:
+                times.append(dflowfm.get_current_time())
+                water_levels.append(water_level.copy())
+                water_depths.append(water_depth.copy())
+
+            # map the exchange data straight into the next exchange bus slot
+            if bus is not None:
+                slot = bus.begin_step(dflowfm.get_current_time())
+                level_mf = slot["water_level"]
+                depth_mf = slot["water_depth"]
+                bcq_out = slot["drn_q"], slot["ghb_q"]
+            level_mf.fill(1e30)
+            level_mf[nodes] = water_level
+            depth_mf.fill(1e30)
+            depth_mf[nodes] = water_depth
+
+            if use_emulator:
+                mf6.set_boundaries(level_mf[fill_nodes], depth_mf[fill_nodes])
+                mf6.update()
+                drn_q, ghb_q = mf6.get_bcq()
+                if bus is not None:
+                    np.copyto(bcq_out[0], drn_q.ravel())
+                    np.copyto(bcq_out[1], ghb_q.ravel())
+                    bus.commit()
+                continue
+
+            set_mf6_boundaries(
+                modelname,
+                mf6,
+                level_mf,
+                depth_mf,
+                hysteresis=hysteresis,
+            )
+            mf6.update()
+            hysteresis.record_iterations(mf6)
+
+            # get the volumetric drain and ghb fluxes
+            # these could be provided as a source or sink
+            # of water for D-FLOW FM. A negative value
+            # would be a source of water to D-FLOW FM.
+            # A positive value would be a loss of water
+            # from D-FLOW FM. Drain volumetric fluxes will
+            # always be a source of water to D-FLOW FM.
+            drn_q, ghb_q = get_mf6_bcq(modelname, mf6, out=bcq_out)
+            if bus is not None:
+                bus.commit()
+
+        # Finalize
+        dflowfm.finalize()
+        mf6.finalize()
+
+        # keep the final fluxes after the exchange bus is closed
+        if bus is not None and drn_q is not None:
+            drn_q, ghb_q = drn_q.copy(), ghb_q.copy()
+    finally:
+        if bus is not None:
+            # release every view of the bus slots before the shared
+            # memory is unmapped, reading them afterwards would crash
+            slot = level_mf = depth_mf = bcq_out = None
+            if drn_q is not None and not drn_q.flags.owndata:
+                drn_q = ghb_q = None
+            failed = sys.exc_info()[0] is not None
+            bus.unlink()
+            try:
+                bus.close()
+            except BufferError:
+                # the traceback of an error in the time loop can still
+                # reference slot views; the memory is released at exit
+                if not failed:
+                    raise
+
+    if record_exchange:
+        save_exchange_recording(
+            os.path.join(modelws, "exchange.npz"),
+            times,
+            np.column_stack((x, y, z)),
+            water_levels,
+            water_depths,
+        )
+
+    # boundary switching and MODFLOW 6 solver statistics
+    if not use_emulator:
+        for key, value in hysteresis.statistics().items():
+            print(f"{key}: {value}")
+
+    # to print the final drn_q and ghb_q array data
+    # print(len(drn_q[drn_q != 1e30]), drn_q.shape, drn_q)
+    # print(len(ghb_q[ghb_q != 1e30]), ghb_q.shape, ghb_q)
+    return
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import os
+
+import numpy as np
+
+from new_york_build_mf import load_xyz
+from new_york_tide import cached_tidal_stage
+
+
+def get_exchange_times(sim_length=86400.0, dt=300.0):
+    nsteps = int(sim_length / dt)
+    return dt * np.arange(1, nsteps + 1, dtype=float)
+
+
+def save_exchange_recording(
+    file_path,
+    time,
+    xyz,
+    water_level,
+    water_depth,
+):
+    """Save a D-FLOW FM stage (s1) and depth (hs) sequence
+
+    water_level and water_depth are (nsteps, ncells) arrays on the
+    D-FLOW FM cell centers in xyz.
+
+    """
+    xyz = np.asarray(xyz, dtype=float)
+    dirname = os.path.dirname(file_path)
+    if dirname:
+        os.makedirs(dirname, exist_ok=True)
+    np.savez_compressed(
+        file_path,
+        time=np.asarray(time, dtype=float),
+        x=xyz[:, 0],
+        y=xyz[:, 1],
+        z=xyz[:, 2],
+        water_level=np.asarray(water_level, dtype=float),
+        water_depth=np.asarray(water_depth, dtype=float),
+    )
+    return
+
+
+def load_exchange_recording(file_path):
+    """Return time, xyz, water_level, and water_depth from a recording
+    saved with save_exchange_recording
+
+    """
+    npzfile = np.load(file_path)
+    xyz = np.column_stack((npzfile["x"], npzfile["y"], npzfile["z"]))
+    return (
+        npzfile["time"],
+        xyz,
+        npzfile["water_level"],
+        npzfile["water_depth"],
+    )
+
+
+def surrogate_exchange_recording(
+    xyz=None,
+    time=None,
+    constituents=None,
+):
+    """Return a surrogate D-FLOW FM recording for a spatially uniform
+    tide (by default the A0 + M2 forcing used in build_dflowfm)
+
+    The stage matches a D-FLOW FM run built with forcing="timeseries";
+    the default astronomic forcing has a phase offset and nodal factors.
+
+    """
+    if xyz is None:
+        xyz = load_xyz()
+    xyz = np.asarray(xyz, dtype=float)
+    if time is None:
+        time = get_exchange_times()
+    time = np.asarray(time, dtype=float)
+
+    stage = cached_tidal_stage(time, constituents=constituents)[:, 0]
+    z = xyz[:, 2]
+    water_level = np.maximum(stage[:, np.newaxis], z[np.newaxis, :])
+    water_depth = water_level - z[np.newaxis, :]
+    return time, xyz, water_level, water_depth
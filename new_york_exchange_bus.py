@@ -0,0 +1,277 @@
+import json
+import sys
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+exchange_fields = ("water_level", "water_depth", "drn_q", "ghb_q")
+default_slots = 16
+
+_magic = 0x4E594258  # "NYBX"
+_header_size = 8
+_names_size = 1024
+
+
+class ExchangeBusLagError(Exception):
+    """Raised when a reader asks for a step that has been overwritten"""
+
+    def __init__(self, seq, oldest):
+        super().__init__(
+            f"step {seq} has been overwritten, oldest available is {oldest}"
+        )
+        self.seq = seq
+        self.oldest = oldest
+
+
+class ExchangeBus:
+    """Publish/subscribe exchange of the coupled state through a named
+    shared-memory ring buffer
+
+    The coupler writes each step directly into the next slot of the
+    ring (begin_step/commit) so publishing costs the same whatever the
+    number of readers. Readers in other processes attach by name and
+    use the step sequence numbers to detect that they are lagging.
+    Every slot has a sequence word that is odd while the slot is being
+    written, so readers can detect torn reads.
+
+    Shared memory layout (float64/int64):
+        header   magic, nslots, ncells, nfields, latest sequence
+        names    JSON list of field names
+        slot_seq sequence word of each slot
+        times    model time of each slot
+        data     (nslots, nfields, ncells)
+
+    """
+
+    def __init__(self, shm, owner):
+        self._shm = shm
+        self._owner = owner
+        buf = shm.buf
+        self._header = np.ndarray(_header_size, dtype=np.int64, buffer=buf)
+        if self._header[0] != _magic:
+            raise ValueError(f"{shm.name} is not an exchange bus")
+        self.nslots = int(self._header[1])
+        self.ncells = int(self._header[2])
+        nfields = int(self._header[3])
+        offset = self._header.nbytes
+        names = bytes(buf[offset : offset + _names_size]).rstrip(b"\0")
+        self.fields = tuple(json.loads(names.decode()))
+        if len(self.fields) != nfields:
+            raise ValueError(f"{shm.name} has an inconsistent header")
+        offset += _names_size
+        self._slot_seq = np.ndarray(
+            self.nslots,
+            dtype=np.int64,
+            buffer=buf,
+            offset=offset,
+        )
+        offset += self._slot_seq.nbytes
+        self._times = np.ndarray(
+            self.nslots,
+            dtype=np.float64,
+            buffer=buf,
+            offset=offset,
+        )
+        offset += self._times.nbytes
+        self._data = np.ndarray(
+            (self.nslots, nfields, self.ncells),
+            dtype=np.float64,
+            buffer=buf,
+            offset=offset,
+        )
+        self._writing = None
+
+    @staticmethod
+    def get_size(ncells, nfields, nslots):
+        return (
+            8 * _header_size
+            + _names_size
+            + 16 * nslots
+            + 8 * nslots * nfields * ncells
+        )
+
+    @classmethod
+    def create(
+        cls,
+        name,
+        ncells,
+        fields=exchange_fields,
+        nslots=default_slots,
+    ):
+        """Create a new exchange bus for ncells values per field"""
+        names = json.dumps(list(fields)).encode()
+        if len(names) > _names_size:
+            raise ValueError("exchange bus field names are too long")
+        size = cls.get_size(ncells, len(fields), nslots)
+        shm = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray(_header_size, dtype=np.int64, buffer=shm.buf)
+        header[:] = 0
+        header[:4] = _magic, nslots, ncells, len(fields)
+        offset = header.nbytes
+        names = names.ljust(_names_size, b"\0")
+        shm.buf[offset : offset + _names_size] = names
+        del header
+        bus = cls(shm, owner=True)
+        bus._slot_seq[:] = 0
+        return bus
+
+    @classmethod
+    def attach(cls, name):
+        """Attach to an existing exchange bus"""
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name=name, track=False)
+        else:
+            from multiprocessing import resource_tracker
+
+            # keep the resource tracker from unlinking the bus when a
+            # reader exits
+            shm = shared_memory.SharedMemory(name=name)
+            resource_tracker.unregister(shm._name, "shared_memory")
+        return cls(shm, owner=False)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    @property
+    def latest(self):
+        """Sequence number of the last published step (0 if none)"""
+        return int(self._header[4])
+
+    @property
+    def oldest(self):
+        """Sequence number of the oldest step still in the ring"""
+        return max(1, self.latest - self.nslots + 1)
+
+    def begin_step(self, model_time):
+        """Return writable views of the next slot, one per field"""
+        seq = self.latest + 1
+        slot = (seq - 1) % self.nslots
+        self._slot_seq[slot] = 2 * seq - 1
+        self._times[slot] = model_time
+        self._writing = seq
+        return {
+            field: self._data[slot, idx]
+            for idx, field in enumerate(self.fields)
+        }
+
+    def commit(self):
+        """Publish the slot returned by begin_step"""
+        seq = self._writing
+        slot = (seq - 1) % self.nslots
+        self._slot_seq[slot] = 2 * seq
+        self._header[4] = seq
+        self._writing = None
+        return seq
+
+    def publish(self, model_time, **values):
+        """Copy values into the next slot and publish it"""
+        slot = self.begin_step(model_time)
+        for field, value in values.items():
+            np.copyto(slot[field], np.ravel(value))
+        return self.commit()
+
+    def read(self, seq=None, out=None):
+        """Return the sequence number, model time, and a copy of the
+        values of step seq (the latest step if seq is None)
+
+        Raises ExchangeBusLagError if step seq has been overwritten and
+        returns None if it has not been published yet.
+
+        """
+        if seq is None:
+            seq = self.latest
+        if seq < 1 or seq > self.latest:
+            return None
+        if out is None:
+            out = np.empty((len(self.fields), self.ncells), dtype=np.float64)
+        slot = (seq - 1) % self.nslots
+        while True:
+            if self._slot_seq[slot] != 2 * seq:
+                raise ExchangeBusLagError(seq, self.oldest)
+            model_time = float(self._times[slot])
+            np.copyto(out, self._data[slot])
+            if self._slot_seq[slot] == 2 * seq:
+                break
+        values = {field: out[idx] for idx, field in enumerate(self.fields)}
+        return seq, model_time, values
+
+    def poll(self, last_seq, timeout=None, interval=0.01):
+        """Wait for a step after last_seq and return the next sequence
+        number to read and the number of steps the reader is behind
+
+        Returns (None, 0) if timeout (seconds) passes first.
+
+        """
+        t0 = time.perf_counter()
+        while self.latest <= last_seq:
+            if timeout is not None and time.perf_counter() - t0 > timeout:
+                return None, 0
+            time.sleep(interval)
+        seq = max(last_seq + 1, self.oldest)
+        return seq, self.latest - seq
+
+    def close(self):
+        """Close the shared memory
+
+        Raises BufferError while views returned by begin_step are still
+        referenced, because reading them after the shared memory is
+        unmapped crashes the interpreter.
+
+        """
+        if self._data is None:
+            return
+        # every slot view keeps a reference to self._data as its base
+        if sys.getrefcount(self._data) > 2:
+            raise BufferError(
+                f"views of exchange bus {self.name} are still in use; "
+                + "delete them before closing the bus"
+            )
+        # release the numpy views before closing the shared memory
+        self._header = self._slot_seq = self._times = self._data = None
+        self._shm.close()
+        return
+
+    def unlink(self):
+        if self._owner:
+            self._shm.unlink()
+        return
+
+
+def monitor(name, timeout=60.0):
+    """Print a summary of every step published on an exchange bus"""
+    bus = ExchangeBus.attach(name)
+    last_seq = 0
+    try:
+        while True:
+            seq, behind = bus.poll(last_seq, timeout=timeout)
+            if seq is None:
+                break
+            if seq > last_seq + 1:
+                print(f"skipped steps {last_seq + 1} to {seq - 1}")
+            try:
+                seq, model_time, values = bus.read(seq)
+            except ExchangeBusLagError as e:
+                print(e)
+                last_seq = e.oldest - 1
+                continue
+            summary = []
+            for field, value in values.items():
+                value = value[value != 1e30]
+                if value.size:
+                    summary.append(
+                        f"{field}: {value.min():.4g}/{value.max():.4g}"
+                    )
+            print(
+                f"step {seq} time {model_time:g} behind {behind} "
+                + ", ".join(summary)
+            )
+            last_seq = seq
+    finally:
+        bus.close()
+    return
+
+
+if __name__ == "__main__":
+    monitor(sys.argv[1])
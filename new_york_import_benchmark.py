@@ -0,0 +1,53 @@
+import subprocess
+import sys
+import time
+
+# modules and commands that should start quickly
+benchmarks = {
+    "import new_york": [sys.executable, "-c", "import new_york"],
+    "import new_york_build_dflow": [
+        sys.executable,
+        "-c",
+        "import new_york_build_dflow",
+    ],
+    "import new_york_build_mf": [
+        sys.executable,
+        "-c",
+        "import new_york_build_mf",
+    ],
+    "import new_york_df": [sys.executable, "-c", "import new_york_df"],
+    "import new_york_mf": [sys.executable, "-c", "import new_york_mf"],
+    "import new_york_dfmf": [sys.executable, "-c", "import new_york_dfmf"],
+    "new_york.py --help": [sys.executable, "new_york.py", "--help"],
+}
+baseline = [sys.executable, "-c", "pass"]
+threshold = 1.0
+
+
+def time_command(command, repeat=5):
+    """Return the fastest wall time of a command in a new interpreter"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        subprocess.run(command, check=True, capture_output=True)
+        times.append(time.perf_counter() - t0)
+    return min(times)
+
+
+def run_benchmarks(repeat=5, threshold=threshold):
+    interpreter = time_command(baseline, repeat=repeat)
+    print(f"{'python startup':<32s} {interpreter:8.3f} s")
+    slow = []
+    for name, command in benchmarks.items():
+        elapsed = time_command(command, repeat=repeat)
+        print(f"{name:<32s} {elapsed:8.3f} s")
+        if elapsed > threshold:
+            slow.append(name)
+    return slow
+
+
+if __name__ == "__main__":
+    slow = run_benchmarks()
+    if slow:
+        print(f"slower than {threshold} s: {', '.join(slow)}")
+        sys.exit(1)
@@ -0,0 +1,292 @@
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from new_york_build_mf import (
+    WetDryHysteresis,
+    build_mf6,
+    dflowfm_sequence_to_array,
+    get_dflowfm_nodes,
+    get_fill_nodes,
+    get_hysteresis_options,
+    get_mf6_bcq,
+    get_sizes,
+    mfapiexe,
+    set_mf6_boundaries,
+    xy_from_xyz,
+)
+from new_york_exchange import get_exchange_times, load_exchange_recording
+
+modelname = "new_york"
+replay_ws = "model_replay"
+default_recording = os.path.join("model_dfmf", "exchange.npz")
+
+# MODFLOW 6 only scenario; None uses the build_mf6 default
+scenario = {
+    "k": None,
+    "k33": None,
+    "recharge": None,
+    "conductance": None,
+}
+
+
+def read_dflowfm_map(map_path):
+    """Return time, xyz, water_level (s1), and water_depth (hs) from a
+    D-FLOW FM map file
+
+    Times are relative to the first record, which is the initial state
+    (time 0), so that match_time_axis can interpolate the first MODFLOW
+    6 time steps when the map output interval is longer than dt.
+
+    """
+    import netCDF4
+
+    with netCDF4.Dataset(map_path) as ds:
+        time = np.array(ds.variables["time"][:], dtype=float)
+        x = np.array(ds.variables["mesh2d_face_x"][:], dtype=float)
+        y = np.array(ds.variables["mesh2d_face_y"][:], dtype=float)
+        z = np.array(ds.variables["mesh2d_flowelem_bl"][:], dtype=float)
+        water_level = np.array(ds.variables["mesh2d_s1"][:], dtype=float)
+        water_depth = np.array(
+            ds.variables["mesh2d_waterdepth"][:],
+            dtype=float,
+        )
+    return (
+        time - time[0],
+        np.column_stack((x, y, z)),
+        water_level,
+        water_depth,
+    )
+
+
+def load_dflowfm_sequence(file_path):
+    """Return time, xyz, water_level, and water_depth from a D-FLOW FM
+    map file (.nc) or an exchange recording (.npz)
+
+    """
+    if str(file_path).endswith(".nc"):
+        return read_dflowfm_map(file_path)
+    return load_exchange_recording(file_path)
+
+
+def match_time_axis(
+    time,
+    water_level,
+    water_depth,
+    sim_length=86400.0,
+    dt=300.0,
+):
+    """Return the D-FLOW FM water level and depth at the end of every
+    MODFLOW 6 time step
+
+    A sequence recorded every dt seconds is used as is, skipping an
+    initial state record at time 0. Any other time axis that covers the
+    whole simulation (from time 0 or the end of the first step) is
+    linearly interpolated to the MODFLOW 6 times; a ValueError is
+    raised if it does not.
+
+    """
+    mf6_time = get_exchange_times(sim_length=sim_length, dt=dt)
+    nsteps = mf6_time.shape[0]
+    time = np.asarray(time, dtype=float)
+    water_level = np.asarray(water_level, dtype=float)
+    water_depth = np.asarray(water_depth, dtype=float)
+    tolerance = 1e-6 * dt
+    i0 = np.count_nonzero(time[:1] <= tolerance)
+    if time.shape[0] - i0 >= nsteps and np.allclose(
+        time[i0 : i0 + nsteps], mf6_time, rtol=0.0, atol=tolerance
+    ):
+        return (
+            water_level[i0 : i0 + nsteps],
+            water_depth[i0 : i0 + nsteps],
+        )
+
+    if time.shape[0] < 2 or np.any(np.diff(time) <= 0.0):
+        raise ValueError("the recorded times must be strictly increasing")
+    start, end = mf6_time[0], mf6_time[-1]
+    if time[0] > start + tolerance or time[-1] < end - tolerance:
+        raise ValueError(
+            f"the recording covers {time[0]:g} to {time[-1]:g} s but the "
+            + f"MODFLOW 6 time steps end at {start:g} to {end:g} s "
+            + f"(dt={dt:g}, sim_length={sim_length:g}); write the D-FLOW "
+            + "FM map output every dt seconds or use a dt and sim_length "
+            + "that the recording covers"
+        )
+    idx = np.clip(np.searchsorted(time, mf6_time), 1, time.shape[0] - 1)
+    weight = (mf6_time - time[idx - 1]) / (time[idx] - time[idx - 1])
+    weight = np.clip(weight, 0.0, 1.0)[:, np.newaxis]
+    return (
+        (1.0 - weight) * water_level[idx - 1] + weight * water_level[idx],
+        (1.0 - weight) * water_depth[idx - 1] + weight * water_depth[idx],
+    )
+
+
+def remap_sequence(modelgrid, xyz, water_level, water_depth):
+    """Map a D-FLOW FM water level and depth sequence to the MODFLOW 6
+    grid in one vectorized pass
+
+    MODFLOW 6 cells without a D-FLOW FM cell (for example the open
+    boundary cells that are not included in map files) use the values
+    of the nearest cell that has one.
+
+    """
+    nodes = get_dflowfm_nodes(modelgrid, xy_from_xyz(xyz))
+    shape1d, _ = get_sizes()
+    fill_nodes = None
+    if np.unique(nodes).shape[0] < shape1d:
+        fill_nodes = get_fill_nodes(modelgrid, nodes)
+    return (
+        dflowfm_sequence_to_array(nodes, water_level, fill_nodes=fill_nodes),
+        dflowfm_sequence_to_array(nodes, water_depth, fill_nodes=fill_nodes),
+    )
+
+
+def run_mf6_sequence(
+    modelws,
+    water_level,
+    water_depth,
+    hysteresis=None,
+    recharge_rate=None,
+    conductance=None,
+):
+    """Run an existing MODFLOW 6 simulation through the API using
+    water levels and depths on the MODFLOW 6 grid ((nsteps, ncells)
+    arrays) and return the DRN and GHB volumetric fluxes for every
+    step as (nsteps, ncells) arrays
+
+    """
+    from modflowapi import ModflowApi
+
+    nsteps = water_level.shape[0]
+    shape1d, _ = get_sizes()
+    drn_q = np.zeros((nsteps, shape1d), dtype=float)
+    ghb_q = np.zeros((nsteps, shape1d), dtype=float)
+
+    mf6 = ModflowApi(mfapiexe)
+    mf6.initialize(os.path.join(modelws, "mfsim.nam"))
+    for step in range(nsteps):
+        if mf6.get_current_time() >= mf6.get_end_time():
+            break
+        set_mf6_boundaries(
+            modelname,
+            mf6,
+            water_level[step],
+            water_depth[step],
+            hysteresis=hysteresis,
+            recharge_rate=recharge_rate,
+            conductance=conductance,
+        )
+        mf6.update()
+        if hysteresis is not None:
+            hysteresis.record_iterations(mf6)
+        drn, ghb = get_mf6_bcq(modelname, mf6)
+        drn_q[step] = bcq_to_1darray(drn)
+        ghb_q[step] = bcq_to_1darray(ghb)
+    mf6.finalize()
+    return drn_q, ghb_q
+
+
+def bcq_to_1darray(q):
+    q = q.ravel().copy()
+    q[q == 1e30] = 0.0
+    return q
+
+
+def replay_mf6(
+    file_path=default_recording,
+    modelws=replay_ws,
+    scenario=scenario,
+    strt=None,
+    hysteresis=None,
+    sim_length=86400.0,
+    dt=300.0,
+    verbose=False,
+):
+    """Drive the transient MODFLOW 6 model with a recorded D-FLOW FM
+    water level and depth sequence without running D-FLOW FM
+
+    The recording is checked against (and if needed interpolated to)
+    the MODFLOW 6 time steps given by sim_length and dt.
+
+    """
+    if scenario is None:
+        scenario = {}
+    t0 = time.perf_counter()
+    times, xyz, dflowfm_level, dflowfm_depth = load_dflowfm_sequence(
+        file_path
+    )
+    dflowfm_level, dflowfm_depth = match_time_axis(
+        times,
+        dflowfm_level,
+        dflowfm_depth,
+        sim_length=sim_length,
+        dt=dt,
+    )
+    sim = build_mf6(
+        modelws,
+        modelname=modelname,
+        transient=True,
+        strt=strt,
+        xyz=None,
+        clean=True,
+        solver_print="NONE",
+        k=scenario.get("k"),
+        k33=scenario.get("k33"),
+        recharge=scenario.get("recharge"),
+        conductance=scenario.get("conductance"),
+        sim_length=sim_length,
+        dt=dt,
+    )
+    water_level, water_depth = remap_sequence(
+        sim.get_model().modelgrid,
+        xyz,
+        dflowfm_level,
+        dflowfm_depth,
+    )
+    setup_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    drn_q, ghb_q = run_mf6_sequence(
+        modelws,
+        water_level,
+        water_depth,
+        hysteresis=hysteresis,
+        recharge_rate=scenario.get("recharge"),
+        conductance=scenario.get("conductance"),
+    )
+    run_time = time.perf_counter() - t0
+
+    np.savez_compressed(
+        os.path.join(modelws, "replay_bcq.npz"),
+        drn_q=drn_q,
+        ghb_q=ghb_q,
+    )
+    if verbose:
+        print(f"replay setup time: {setup_time:.3f} s")
+        print(f"replay MODFLOW 6 time: {run_time:.3f} s")
+    return drn_q, ghb_q
+
+
+if __name__ == "__main__":
+    import flopy
+
+    file_path = default_recording
+    if len(sys.argv) > 1:
+        file_path = sys.argv[1]
+    if len(sys.argv) > 2:
+        with open(sys.argv[2]) as f:
+            scenario = json.load(f)
+    strt = flopy.utils.HeadFile("data/new_york.hds").get_data()
+    hysteresis = WetDryHysteresis(**get_hysteresis_options())
+    replay_mf6(
+        file_path,
+        scenario=scenario,
+        strt=strt,
+        hysteresis=hysteresis,
+        verbose=True,
+    )
+    for key, value in hysteresis.statistics().items():
+        print(f"{key}: {value}")
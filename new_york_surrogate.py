@@ -0,0 +1,383 @@
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from new_york_build_mf import build_mf6, get_dimensions, get_sizes
+from new_york_exchange import get_exchange_times, surrogate_exchange_recording
+from new_york_replay import (
+    load_dflowfm_sequence,
+    match_time_axis,
+    remap_sequence,
+    run_mf6_sequence,
+)
+
+modelname = "new_york"
+surrogate_ws = "model_surrogate"
+reference_level = -0.79485651
+stage_perturbation = 0.1
+
+# run length and time step, in seconds, the emulator is derived for
+# (use the coupled run sim_length)
+sim_length = 86400.0
+dt = 300.0
+
+
+class LinearResponseEmulator:
+    """Linear-response (unit-step response) emulator for the DRN and
+    GHB fluxes of the transient MODFLOW 6 model
+
+    The fluxes are linearized around a reference water level with a
+    fixed set of wet (GHB) and dry (RCH/DRN) cells. The total boundary
+    flux in each cell is predicted by convolving the stage change in
+    every boundary cell with the impulse responses and is assigned to
+    GHB where the predicted water depth is positive and to DRN
+    elsewhere. Drain fluxes are limited to outflow from the aquifer.
+
+    """
+
+    def __init__(
+        self,
+        time,
+        reference_level,
+        reference_depth,
+        base_flux,
+        step_response,
+        sim_length=None,
+        dt=None,
+    ):
+        self.time = np.asarray(time, dtype=float)
+        if sim_length is None:
+            sim_length = float(self.time[-1])
+        if dt is None:
+            dt = float(self.time[0])
+        self.sim_length = float(sim_length)
+        self.dt = float(dt)
+        self.reference_level = np.asarray(reference_level, dtype=float)
+        self.reference_depth = np.asarray(reference_depth, dtype=float)
+        self.base_flux = np.asarray(base_flux, dtype=float)
+        self.step_response = np.asarray(step_response, dtype=float)
+        self.impulse_response = np.diff(
+            self.step_response,
+            axis=0,
+            prepend=0.0,
+        )
+        self._stage = None
+        self._depth = None
+        self._step = 0
+        self._q = None
+
+    @property
+    def nsteps(self):
+        return self.time.shape[0]
+
+    def save(self, file_path):
+        np.savez_compressed(
+            file_path,
+            time=self.time,
+            reference_level=self.reference_level,
+            reference_depth=self.reference_depth,
+            base_flux=self.base_flux,
+            step_response=self.step_response,
+            sim_length=self.sim_length,
+            dt=self.dt,
+        )
+        return
+
+    @classmethod
+    def load(cls, file_path):
+        npzfile = np.load(file_path)
+        kwargs = {
+            key: float(npzfile[key])
+            for key in ("sim_length", "dt")
+            if key in npzfile.files
+        }
+        return cls(
+            npzfile["time"],
+            npzfile["reference_level"],
+            npzfile["reference_depth"],
+            npzfile["base_flux"],
+            npzfile["step_response"],
+            **kwargs,
+        )
+
+    def _split_flux(self, q, water_depth):
+        wet = water_depth > 0.0
+        drn_q = np.where(wet, 0.0, np.minimum(q, 0.0))
+        ghb_q = np.where(wet, q, 0.0)
+        return drn_q, ghb_q
+
+    def predict(self, water_level, water_depth):
+        """Return the DRN and GHB fluxes ((nsteps, ncells) arrays) for a
+        water level and depth history on the MODFLOW 6 grid using
+        FFT-based convolution
+
+        """
+        water_level = np.asarray(water_level, dtype=float)
+        water_depth = np.asarray(water_depth, dtype=float)
+        nsteps = water_level.shape[0]
+        if nsteps > self.nsteps:
+            raise ValueError(
+                f"history has {nsteps} steps but the emulator was "
+                + f"derived for {self.nsteps} steps"
+            )
+        dh = water_level - self.reference_level[np.newaxis, :]
+        nfft = 2 * nsteps
+        h_f = np.fft.rfft(self.impulse_response[:nsteps], n=nfft, axis=0)
+        dh_f = np.fft.rfft(dh, n=nfft, axis=0)
+        q_f = np.einsum("fij,fj->fi", h_f, dh_f)
+        q = np.fft.irfft(q_f, n=nfft, axis=0)[:nsteps]
+        q += self.base_flux[:nsteps]
+        return self._split_flux(q, water_depth)
+
+    # the methods below mirror the ModflowApi/update_mf6/get_mf6_bcq
+    # calls used in the coupling loop
+    def initialize(self):
+        ncells = self.reference_level.shape[0]
+        self._stage = np.zeros((self.nsteps, ncells), dtype=float)
+        self._depth = self.reference_depth.copy()
+        self._step = 0
+        self._q = np.zeros(ncells, dtype=float)
+        return
+
+    def get_current_time(self):
+        if self._step == 0:
+            return 0.0
+        return self.time[self._step - 1]
+
+    def get_end_time(self):
+        return self.time[-1]
+
+    def _check_step(self):
+        if self._stage is None:
+            raise RuntimeError("the emulator has not been initialized")
+        if self._step >= self.nsteps:
+            raise RuntimeError(
+                f"the emulator was derived for {self.nsteps} steps "
+                + f"(end time {self.get_end_time():g}) and cannot be "
+                + "advanced past its end time"
+            )
+        return
+
+    def set_boundaries(self, water_level, water_depth):
+        self._check_step()
+        water_level = np.asarray(water_level, dtype=float)
+        water_depth = np.asarray(water_depth, dtype=float)
+        for name, value in (
+            ("water_level", water_level),
+            ("water_depth", water_depth),
+        ):
+            if value.shape != self.reference_level.shape:
+                raise ValueError(
+                    f"{name} has shape {value.shape} but the emulator "
+                    + f"has {self.reference_level.shape[0]} cells"
+                )
+            invalid = ~np.isfinite(value) | (np.abs(value) >= 1e30)
+            if invalid.any():
+                raise ValueError(
+                    f"{name} has {np.count_nonzero(invalid)} missing or "
+                    + "non-finite values; every MODFLOW 6 cell needs a "
+                    + "value (see remap_sequence)"
+                )
+        self._stage[self._step] = water_level - self.reference_level
+        self._depth = water_depth.copy()
+        return
+
+    def update(self):
+        self._check_step()
+        n = self._step
+        self._q = self.base_flux[n] + np.einsum(
+            "kij,kj->i",
+            self.impulse_response[: n + 1],
+            self._stage[n::-1],
+        )
+        self._step += 1
+        return
+
+    def get_bcq(self):
+        """Return drain and ghb volumetric flow rate as two dimensional
+        arrays with the same layout as get_mf6_bcq
+
+        """
+        _, nrow, ncol = get_dimensions()
+        shape2d = (ncol, nrow)
+        drn_q, ghb_q = self._split_flux(self._q, self._depth)
+        wet = self._depth > 0.0
+        drn_q[wet] = 1e30
+        ghb_q[~wet] = 1e30
+        return drn_q.reshape(shape2d), ghb_q.reshape(shape2d)
+
+    def finalize(self):
+        self._stage = None
+        return
+
+
+def derive_emulator(
+    modelws=surrogate_ws,
+    xyz=None,
+    strt=None,
+    level=reference_level,
+    perturbation=stage_perturbation,
+    sim_length=sim_length,
+    dt=dt,
+    verbose=False,
+):
+    """Derive unit-step response functions for every boundary cell by
+    perturbing the water level in one cell at a time over a run of
+    sim_length seconds with dt second time steps
+
+    """
+    sim = build_mf6(
+        modelws,
+        modelname=modelname,
+        transient=True,
+        strt=strt,
+        xyz=xyz,
+        clean=True,
+        solver_print="NONE",
+        sim_length=sim_length,
+        dt=dt,
+    )
+    top = sim.get_model().dis.top.get_data().ravel()
+    size2d, _ = get_sizes()
+    times = get_exchange_times(sim_length=sim_length, dt=dt)
+    nsteps = times.shape[0]
+
+    reference_level = np.maximum(np.full(size2d, level, dtype=float), top)
+    reference_depth = reference_level - top
+    water_level = np.tile(reference_level, (nsteps, 1))
+    water_depth = np.tile(reference_depth, (nsteps, 1))
+
+    drn_q, ghb_q = run_mf6_sequence(modelws, water_level, water_depth)
+    base_flux = drn_q + ghb_q
+
+    step_response = np.zeros((nsteps, size2d, size2d), dtype=float)
+    for node in range(size2d):
+        if verbose:
+            print(f"deriving step response {node + 1}/{size2d}")
+        water_level[:, node] += perturbation
+        drn_q, ghb_q = run_mf6_sequence(modelws, water_level, water_depth)
+        water_level[:, node] -= perturbation
+        step_response[:, :, node] = (drn_q + ghb_q - base_flux) / perturbation
+
+    return LinearResponseEmulator(
+        times,
+        reference_level,
+        reference_depth,
+        base_flux,
+        step_response,
+        sim_length=sim_length,
+        dt=dt,
+    )
+
+
+def _flux_errors(q_emulator, q_full):
+    error = q_emulator - q_full
+    rms_full = float(np.sqrt(np.mean(q_full**2)))
+    rmse = float(np.sqrt(np.mean(error**2)))
+    relative_rmse = None
+    if rms_full > 0.0:
+        relative_rmse = rmse / rms_full
+    return {
+        "rmse": rmse,
+        "max_abs_error": float(np.abs(error).max()),
+        "relative_rmse": relative_rmse,
+        "total_flux_full": float(q_full.sum()),
+        "total_flux_emulator": float(q_emulator.sum()),
+    }
+
+
+def emulator_error_report(
+    emulator,
+    recording=None,
+    modelws=surrogate_ws,
+    strt=None,
+    report_path=None,
+):
+    """Compare the emulator with the full MODFLOW 6 model for a
+    recorded (or surrogate) D-FLOW FM sequence
+
+    The recording is checked against (and if needed interpolated to)
+    the time steps the emulator was derived for.
+
+    """
+    if recording is None:
+        _, xyz, dflowfm_level, dflowfm_depth = surrogate_exchange_recording(
+            time=emulator.time
+        )
+    else:
+        times, xyz, dflowfm_level, dflowfm_depth = load_dflowfm_sequence(
+            recording
+        )
+        dflowfm_level, dflowfm_depth = match_time_axis(
+            times,
+            dflowfm_level,
+            dflowfm_depth,
+            sim_length=emulator.sim_length,
+            dt=emulator.dt,
+        )
+    sim = build_mf6(
+        modelws,
+        modelname=modelname,
+        transient=True,
+        strt=strt,
+        xyz=None,
+        clean=True,
+        solver_print="NONE",
+        sim_length=emulator.sim_length,
+        dt=emulator.dt,
+    )
+    nsteps = dflowfm_level.shape[0]
+    water_level, water_depth = remap_sequence(
+        sim.get_model().modelgrid,
+        xyz,
+        dflowfm_level,
+        dflowfm_depth,
+    )
+
+    t0 = time.perf_counter()
+    drn_full, ghb_full = run_mf6_sequence(modelws, water_level, water_depth)
+    full_time = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    drn_emulator, ghb_emulator = emulator.predict(water_level, water_depth)
+    emulator_time = time.perf_counter() - t0
+
+    report = {
+        "steps": nsteps,
+        "full_wall_time": full_time,
+        "emulator_wall_time": emulator_time,
+        "speedup": full_time / max(emulator_time, 1e-12),
+        "drn": _flux_errors(drn_emulator, drn_full),
+        "ghb": _flux_errors(ghb_emulator, ghb_full),
+    }
+    if report_path is not None:
+        with open(report_path, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+if __name__ == "__main__":
+    import flopy
+
+    recording = None
+    if len(sys.argv) > 1:
+        recording = sys.argv[1]
+    strt = flopy.utils.HeadFile("data/new_york.hds").get_data()
+    emulator = derive_emulator(
+        strt=strt,
+        sim_length=sim_length,
+        dt=dt,
+        verbose=True,
+    )
+    emulator.save(os.path.join(surrogate_ws, "emulator.npz"))
+    report = emulator_error_report(
+        emulator,
+        recording=recording,
+        modelws=os.path.join(surrogate_ws, "check"),
+        strt=strt,
+        report_path=os.path.join(surrogate_ws, "error_report.json"),
+    )
+    print(json.dumps(report, indent=2))
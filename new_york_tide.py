@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+tide_cache_dir = "tide_cache"
+
+# constituent angular speeds, in degrees per hour
+constituent_speeds = {
+    "M2": 28.9841042,
+    "S2": 30.0000000,
+    "N2": 28.4397295,
+    "K2": 30.0821373,
+    "2N2": 27.8953548,
+    "MU2": 27.9682084,
+    "NU2": 28.5125831,
+    "L2": 29.5284789,
+    "T2": 29.9589333,
+    "K1": 15.0410686,
+    "O1": 13.9430356,
+    "P1": 14.9589314,
+    "Q1": 13.3986609,
+    "J1": 15.5854433,
+    "M4": 57.9682084,
+    "MS4": 58.9841042,
+    "MN4": 57.4238337,
+    "M6": 86.9523127,
+    "M8": 115.9364166,
+    "MF": 1.0980331,
+    "MM": 0.5443747,
+    "SSA": 0.0821373,
+    "SA": 0.0410686,
+}
+
+
+def get_constituents():
+    """Return the constituents used by build_dflowfm as a dictionary of
+    (amplitude, phase) pairs with amplitudes in meters and phases in
+    degrees. A0 is the mean water level.
+
+    """
+    return {
+        "A0": (0.5, 0.0),
+        "M2": (2.0, 0.0),
+    }
+
+
+def _constituent_arrays(constituents, npoints):
+    names = [name for name in constituents if name.upper() != "A0"]
+    for name in names:
+        if name.upper() not in constituent_speeds:
+            raise ValueError(f"unknown tidal constituent: {name}")
+    speed = np.array(
+        [constituent_speeds[name.upper()] for name in names],
+        dtype=float,
+    )
+    amplitude = np.zeros((len(names), npoints), dtype=float)
+    phase = np.zeros((len(names), npoints), dtype=float)
+    for idx, name in enumerate(names):
+        amplitude[idx] = np.broadcast_to(constituents[name][0], npoints)
+        phase[idx] = np.broadcast_to(constituents[name][1], npoints)
+    mean_level = np.zeros(npoints, dtype=float)
+    for name in constituents:
+        if name.upper() == "A0":
+            mean_level[:] = np.broadcast_to(constituents[name][0], npoints)
+    return names, np.radians(speed) / 3600.0, amplitude, phase, mean_level
+
+
+def tidal_stage(time, constituents=None, npoints=1):
+    """Return the tidal stage for every time (in seconds) and boundary
+    support point as a (ntimes, npoints) array
+
+    Amplitudes and phases can be scalars or arrays with a value for
+    every support point. All constituents are evaluated in one pass:
+
+        stage = A0 + cos(wt) (A cos(phi)) + sin(wt) (A sin(phi))
+
+    Nodal corrections and astronomical arguments are not applied.
+
+    """
+    if constituents is None:
+        constituents = get_constituents()
+    time = np.asarray(time, dtype=float)
+    _, omega, amplitude, phase, mean_level = _constituent_arrays(
+        constituents,
+        npoints,
+    )
+    phase = np.radians(phase)
+    wt = np.outer(time, omega)
+    stage = np.cos(wt) @ (amplitude * np.cos(phase))
+    stage += np.sin(wt) @ (amplitude * np.sin(phase))
+    stage += mean_level[np.newaxis, :]
+    return stage
+
+
+def get_tide_hash(time, constituents, npoints):
+    items = {
+        name.upper(): [
+            np.broadcast_to(value, npoints).tolist()
+            for value in constituents[name]
+        ]
+        for name in constituents
+    }
+    sha = hashlib.sha256(json.dumps(items, sort_keys=True).encode())
+    sha.update(np.ascontiguousarray(time, dtype=float).tobytes())
+    return sha.hexdigest()
+
+
+def cached_tidal_stage(
+    time,
+    constituents=None,
+    npoints=1,
+    cache_dir=tide_cache_dir,
+):
+    """Return tidal_stage from the disk cache for this constituent set
+    and time axis, computing and saving it if it is not cached
+
+    """
+    if constituents is None:
+        constituents = get_constituents()
+    time = np.asarray(time, dtype=float)
+    tide_hash = get_tide_hash(time, constituents, npoints)
+    cache_path = os.path.join(cache_dir, f"{tide_hash}.npz")
+    if os.path.isfile(cache_path):
+        return np.load(cache_path)["stage"]
+
+    stage = tidal_stage(time, constituents, npoints=npoints)
+    os.makedirs(cache_dir, exist_ok=True)
+    np.savez_compressed(cache_path, time=time, stage=stage)
+    return stage
+
+
+def read_pli_names(pli_path):
+    """Return the support point names in a D-FLOW FM polyline file"""
+    with open(pli_path) as f:
+        lines = [line.split() for line in f if line.strip()]
+    npoints = int(lines[1][0])
+    return [line[2] for line in lines[2 : 2 + npoints]]
+
+
+def astronomic_forcing(names, constituents=None):
+    """Return a hydrolib Astronomic forcing for every support point
+
+    D-FLOW FM applies the nodal factors (f) and the astronomical
+    arguments (V0 + u) for the reference date to astronomic components.
+    V0 + u is a phase offset of up to 360 degrees, so the boundary stage
+    does not match tidal_stage (or the timeseries forcing and the
+    cached series reused by the replay and surrogate scripts).
+
+    """
+    from hydrolib.core.io.bc.models import Astronomic, QuantityUnitPair
+
+    if constituents is None:
+        constituents = get_constituents()
+    npoints = len(names)
+    forcing = []
+    for idx, name in enumerate(names):
+        datablock = []
+        for component, (amplitude, phase) in constituents.items():
+            amplitude = np.broadcast_to(amplitude, npoints)[idx]
+            phase = np.broadcast_to(phase, npoints)[idx]
+            datablock.append([component, f"{amplitude:g}", f"{phase:g}"])
+        forcing.append(
+            Astronomic(
+                name=name,
+                quantityunitpair=[
+                    QuantityUnitPair(
+                        quantity="astronomic component",
+                        unit="-",
+                    ),
+                    QuantityUnitPair(
+                        quantity="waterlevelbnd amplitude",
+                        unit="m",
+                    ),
+                    QuantityUnitPair(
+                        quantity="waterlevelbnd phase",
+                        unit="deg",
+                    ),
+                ],
+                datablock=datablock,
+            )
+        )
+    return forcing
+
+
+def timeseries_forcing(names, time, stage, refdate=20010101):
+    """Return a hydrolib TimeSeries forcing for every support point using
+    a (ntimes, npoints) stage array
+
+    """
+    from hydrolib.core.io.bc.models import (
+        QuantityUnitPair,
+        TimeInterpolation,
+        TimeSeries,
+    )
+
+    refdate = str(refdate)
+    time_unit = (
+        f"seconds since {refdate[:4]}-{refdate[4:6]}-{refdate[6:8]} 00:00:00"
+    )
+    forcing = []
+    for idx, name in enumerate(names):
+        forcing.append(
+            TimeSeries(
+                name=name,
+                timeinterpolation=TimeInterpolation.linear,
+                quantityunitpair=[
+                    QuantityUnitPair(quantity="time", unit=time_unit),
+                    QuantityUnitPair(quantity="waterlevelbnd", unit="m"),
+                ],
+                datablock=[
+                    [float(t), float(v)] for t, v in zip(time, stage[:, idx])
+                ],
+            )
+        )
+    return forcing
@@ -0,0 +1,275 @@
+import itertools
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from new_york_build_mf import (
+    WetDryHysteresis,
+    build_mf6,
+    get_hysteresis_options,
+    get_ims_options,
+    mfapiexe,
+    set_mf6_boundaries,
+)
+from new_york_exchange import get_exchange_times, surrogate_exchange_recording
+from new_york_replay import (
+    load_dflowfm_sequence,
+    match_time_axis,
+    remap_sequence,
+)
+
+modelname = "new_york"
+tuning_ws = "ims_tuning"
+head_tolerance = 1e-3
+
+# IMS settings to test; every combination is run. None leaves the
+# option at the flopy/MODFLOW 6 default (or the complexity preset).
+ims_grid = {
+    "complexity": [None, "simple", "moderate", "complex"],
+    "linear_acceleration": ["bicgstab", "cg"],
+    "outer_dvclose": [1e-6, 1e-4],
+    "inner_dvclose": [1e-9, 1e-6],
+    "under_relaxation": [None, "dbd"],
+    "relaxation_factor": [None, 0.97],
+}
+newton_grid = ["NEWTON UNDER_RELAXATION", "NEWTON", None]
+
+# MODFLOW 6 outer_maximum for the IMS complexity presets
+complexity_outer_maximum = {"simple": 25, "moderate": 50, "complex": 100}
+
+
+def normalize_ims_config(config):
+    """Return config with the outer and inner maximums that are used when
+    no complexity preset is given, so equal settings compare equal
+
+    """
+    config = dict(config)
+    if "complexity" not in config:
+        config.setdefault("outer_maximum", 500)
+        config.setdefault("inner_maximum", 100)
+    return config
+
+
+def get_ims_configs(ims_grid=ims_grid, newton_grid=newton_grid):
+    reference = get_ims_options()
+    reference["newtonoptions"] = "NEWTON UNDER_RELAXATION"
+    configs = [normalize_ims_config(reference)]
+    keys = list(ims_grid.keys())
+    for values in itertools.product(*[ims_grid[key] for key in keys]):
+        ims_options = {
+            key: value for key, value in zip(keys, values) if value is not None
+        }
+        for newtonoptions in newton_grid:
+            config = dict(ims_options)
+            config["newtonoptions"] = newtonoptions
+            config = normalize_ims_config(config)
+            if config not in configs:
+                configs.append(config)
+    return configs
+
+
+def run_ims_config(
+    config,
+    modelws,
+    xyz,
+    water_level,
+    water_depth,
+    strt=None,
+    hysteresis_options=None,
+    sim_length=86400.0,
+    dt=300.0,
+):
+    """Replay a D-FLOW FM stage and depth sequence through
+    set_mf6_boundaries with a single IMS configuration
+
+    The sequence is mapped to the MODFLOW 6 grid before the run and the
+    boundaries switch with the same hysteresis as the coupled run, so
+    wall_time is the time spent in the MODFLOW 6 updates.
+
+    """
+    from modflowapi import ModflowApi
+
+    if hysteresis_options is None:
+        hysteresis_options = get_hysteresis_options()
+    ims_options = normalize_ims_config(config)
+    newtonoptions = ims_options.pop("newtonoptions")
+    if "complexity" in ims_options:
+        outer_maximum = complexity_outer_maximum[ims_options["complexity"]]
+    else:
+        outer_maximum = ims_options["outer_maximum"]
+    sim = build_mf6(
+        modelws,
+        modelname=modelname,
+        transient=True,
+        strt=strt,
+        xyz=xyz,
+        clean=True,
+        solver_print="NONE",
+        ims_options=ims_options,
+        newtonoptions=newtonoptions,
+        sim_length=sim_length,
+        dt=dt,
+    )
+    water_level, water_depth = remap_sequence(
+        sim.get_model().modelgrid,
+        xyz,
+        water_level,
+        water_depth,
+    )
+    hysteresis = WetDryHysteresis(**hysteresis_options)
+
+    mf6 = ModflowApi(mfapiexe)
+    mf6.initialize(os.path.join(modelws, "mfsim.nam"))
+
+    converged = True
+    heads = None
+    wall_time = 0.0
+    try:
+        for step in range(water_level.shape[0]):
+            if mf6.get_current_time() >= mf6.get_end_time():
+                break
+            set_mf6_boundaries(
+                modelname,
+                mf6,
+                water_level[step],
+                water_depth[step],
+                hysteresis=hysteresis,
+            )
+            t0 = time.perf_counter()
+            mf6.update()
+            wall_time += time.perf_counter() - t0
+            outer, _ = hysteresis.record_iterations(mf6)
+            if outer >= outer_maximum:
+                converged = False
+                break
+        heads = mf6.get_value(mf6.get_var_address("X", modelname)).copy()
+    except Exception as e:
+        print(f"{config} failed: {e}")
+        converged = False
+    outer_iterations = hysteresis.outer_iterations
+    inner_iterations = hysteresis.inner_iterations
+
+    try:
+        mf6.finalize()
+    except Exception:
+        pass
+
+    return {
+        "config": config,
+        "converged": converged,
+        "wall_time": wall_time,
+        "steps": len(outer_iterations),
+        "outer_iterations": int(np.sum(outer_iterations)),
+        "inner_iterations": int(np.sum(inner_iterations)),
+        "max_outer_iterations": int(np.max(outer_iterations, initial=0)),
+    }, heads
+
+
+def tune_ims(
+    recording=None,
+    configs=None,
+    modelws=tuning_ws,
+    head_tolerance=head_tolerance,
+    strt=None,
+    hysteresis_options=None,
+    sim_length=86400.0,
+    dt=300.0,
+    verbose=False,
+):
+    """Run every IMS configuration and return the results and the
+    fastest configuration that converges with heads within
+    head_tolerance of the reference (current build_mf6) configuration
+
+    recording is an exchange recording (.npz) or a D-FLOW FM map file
+    (.nc) and is checked against (and if needed interpolated to) the
+    MODFLOW 6 time steps given by sim_length and dt.
+
+    """
+    if recording is None:
+        _, xyz, water_level, water_depth = surrogate_exchange_recording(
+            time=get_exchange_times(sim_length=sim_length, dt=dt)
+        )
+    else:
+        times, xyz, water_level, water_depth = load_dflowfm_sequence(
+            recording
+        )
+        water_level, water_depth = match_time_axis(
+            times,
+            water_level,
+            water_depth,
+            sim_length=sim_length,
+            dt=dt,
+        )
+    if configs is None:
+        configs = get_ims_configs()
+    run_ws = os.path.join(modelws, "run")
+
+    results = []
+    reference_heads = None
+    for idx, config in enumerate(configs):
+        result, heads = run_ims_config(
+            config,
+            run_ws,
+            xyz,
+            water_level,
+            water_depth,
+            strt=strt,
+            hysteresis_options=hysteresis_options,
+            sim_length=sim_length,
+            dt=dt,
+        )
+        if idx == 0:
+            reference_heads = heads
+        if heads is None or reference_heads is None:
+            result["max_head_difference"] = None
+            result["within_tolerance"] = False
+        else:
+            dh = float(np.abs(heads - reference_heads).max())
+            result["max_head_difference"] = dh
+            result["within_tolerance"] = result["converged"] and (
+                dh <= head_tolerance
+            )
+        results.append(result)
+        if verbose:
+            print(
+                f"{idx + 1}/{len(configs)} {config} "
+                + f"converged: {result['converged']}, "
+                + f"wall time: {result['wall_time']:.3f} s, "
+                + f"outer: {result['outer_iterations']}, "
+                + f"inner: {result['inner_iterations']}"
+            )
+
+    candidates = [result for result in results if result["within_tolerance"]]
+    best = None
+    if candidates:
+        best = min(candidates, key=lambda result: result["wall_time"])
+
+    with open(os.path.join(modelws, "ims_tuning.json"), "w") as f:
+        json.dump(results, f, indent=2)
+    if best is not None:
+        with open(os.path.join(modelws, "best_ims.json"), "w") as f:
+            json.dump(best["config"], f, indent=2)
+
+    return results, best
+
+
+if __name__ == "__main__":
+    import flopy
+
+    recording = None
+    if len(sys.argv) > 1:
+        recording = sys.argv[1]
+    strt = flopy.utils.HeadFile("data/new_york.hds").get_data()
+    results, best = tune_ims(recording=recording, strt=strt, verbose=True)
+    if best is None:
+        print("no IMS configuration converged within tolerance")
+    else:
+        reference = results[0]
+        print(f"fastest IMS configuration: {best['config']}")
+        print(
+            f"wall time: {best['wall_time']:.3f} s "
+            + f"(reference {reference['wall_time']:.3f} s)"
+        )
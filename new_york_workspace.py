@@ -0,0 +1,359 @@
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import time
+
+from new_york_build_dflow import build_dflowfm
+
+template_root = "templates"
+initial_files = "initial_files"
+template_stamp = ".template_hash"
+
+# files that are copied instead of linked because they can differ
+# between runs (the {modelname} placeholder is replaced)
+default_copy_files = ("{modelname}.mdu",)
+
+
+def _remove_linked_file(path):
+    """Remove a read-only hard link on Windows without clearing the
+    read-only attribute, which is shared by every link to the file
+
+    """
+    import ctypes
+    from ctypes import wintypes
+
+    kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    kernel32.CreateFileW.restype = wintypes.HANDLE
+    kernel32.CreateFileW.argtypes = (
+        wintypes.LPCWSTR,
+        wintypes.DWORD,
+        wintypes.DWORD,
+        wintypes.LPVOID,
+        wintypes.DWORD,
+        wintypes.DWORD,
+        wintypes.HANDLE,
+    )
+    kernel32.SetFileInformationByHandle.argtypes = (
+        wintypes.HANDLE,
+        ctypes.c_int,
+        wintypes.LPVOID,
+        wintypes.DWORD,
+    )
+    kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+
+    # DELETE access, shared read/write/delete, OPEN_EXISTING, and
+    # FILE_FLAG_OPEN_REPARSE_POINT
+    handle = kernel32.CreateFileW(
+        os.path.abspath(path), 0x00010000, 0x7, None, 3, 0x00200000, None
+    )
+    if handle == wintypes.HANDLE(-1).value:
+        raise ctypes.WinError(ctypes.get_last_error())
+    try:
+        # FileDispositionInfoEx with FILE_DISPOSITION_FLAG_DELETE,
+        # POSIX_SEMANTICS, and IGNORE_READONLY_ATTRIBUTE
+        flags = wintypes.DWORD(0x1 | 0x2 | 0x10)
+        if not kernel32.SetFileInformationByHandle(
+            handle, 21, ctypes.byref(flags), ctypes.sizeof(flags)
+        ):
+            raise ctypes.WinError(ctypes.get_last_error())
+    finally:
+        kernel32.CloseHandle(handle)
+    return
+
+
+def _remove_read_only(func, path, exc):
+    """Retry removing a read-only file or directory
+
+    Files that are hard linked to the template are never made writable
+    because the mode (the read-only attribute on Windows) is shared by
+    the template file. Unlinking them only needs write permission on
+    the directory, except on Windows where they are removed with the
+    read-only attribute ignored.
+
+    """
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) and info.st_nlink > 1:
+        if sys.platform != "win32":
+            raise exc
+        _remove_linked_file(path)
+        return
+    os.chmod(path, stat.S_IWRITE | stat.S_IREAD)
+    func(path)
+    return
+
+
+def _remove_file(path):
+    try:
+        os.remove(path)
+    except PermissionError as e:
+        _remove_read_only(os.remove, path, e)
+    return
+
+
+def remove_workspace(modelws):
+    if not os.path.exists(modelws):
+        return
+    if sys.version_info >= (3, 12):
+        shutil.rmtree(modelws, onexc=_remove_read_only)
+    else:
+        shutil.rmtree(
+            modelws,
+            onerror=lambda func, path, exc_info: _remove_read_only(
+                func, path, exc_info[1]
+            ),
+        )
+    return
+
+
+def get_template_hash(modelname, build_kwargs=None):
+    """Return a hash of everything the D-FLOW FM template is built from"""
+    if build_kwargs is None:
+        build_kwargs = {}
+    sha = hashlib.sha256(modelname.encode())
+    sha.update(json.dumps(build_kwargs, sort_keys=True, default=str).encode())
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    sources = [
+        os.path.join(script_dir, "new_york_build_dflow.py"),
+        os.path.join(script_dir, "new_york_tide.py"),
+    ]
+    for dirpath, _, filenames in sorted(os.walk(initial_files)):
+        for filename in sorted(filenames):
+            sources.append(os.path.join(dirpath, filename))
+    for source in sources:
+        sha.update(os.path.relpath(source).encode())
+        with open(source, "rb") as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def _lock_file(f, shared):
+    if sys.platform == "win32":
+        import msvcrt
+
+        # msvcrt has no shared locks, so readers are serialized too
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+                return
+            except OSError:
+                time.sleep(0.1)
+    else:
+        import fcntl
+
+        fcntl.flock(f.fileno(), fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+    return
+
+
+def _unlock_file(f):
+    if sys.platform == "win32":
+        import msvcrt
+
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    return
+
+
+@contextlib.contextmanager
+def template_lock(modelname, shared=False):
+    """Hold the lock on the template for modelname
+
+    Runs that link files from the template hold a shared lock and a run
+    that rebuilds the template holds an exclusive lock, so the template
+    is never replaced while it is being linked.
+
+    """
+    os.makedirs(template_root, exist_ok=True)
+    lock_path = os.path.join(template_root, f"{modelname}.lock")
+    with open(lock_path, "a") as f:
+        _lock_file(f, shared)
+        try:
+            yield
+        finally:
+            _unlock_file(f)
+
+
+def template_is_current(template_ws, template_hash):
+    stamp_path = os.path.join(template_ws, template_stamp)
+    if not os.path.isfile(stamp_path):
+        return False
+    with open(stamp_path) as f:
+        return f.read().strip() == template_hash
+
+
+def _write_stamp(template_ws, template_hash):
+    stamp_path = os.path.join(template_ws, template_stamp)
+    with open(f"{stamp_path}.tmp", "w") as f:
+        f.write(template_hash)
+    os.replace(f"{stamp_path}.tmp", stamp_path)
+    return
+
+
+def build_template(modelname, build_kwargs=None, verbose=False):
+    """Build the read-only D-FLOW FM template for modelname if it does
+    not exist or is out of date and return its path
+
+    build_kwargs are passed to build_dflowfm (for example constituents,
+    forcing, and tstop). The template is built in a temporary directory
+    and swapped in under the exclusive template lock, and the stamp is
+    only written after the swap, so concurrent runs never link from a
+    partial template.
+
+    """
+    if build_kwargs is None:
+        build_kwargs = {}
+    template_ws = os.path.join(template_root, modelname)
+    template_hash = get_template_hash(modelname, build_kwargs=build_kwargs)
+    if template_is_current(template_ws, template_hash):
+        return template_ws
+
+    with template_lock(modelname):
+        # another run may have rebuilt the template while we waited
+        if template_is_current(template_ws, template_hash):
+            return template_ws
+
+        if verbose:
+            print(f"building workspace template {template_ws}")
+        build_ws = tempfile.mkdtemp(prefix=f".{modelname}-", dir=template_root)
+        try:
+            build_dflowfm(
+                build_ws,
+                modelname=modelname,
+                clean=True,
+                **build_kwargs,
+            )
+
+            # We workaround
+            # - https://github.com/Deltares/HYDROLIB-core/issues/295 and
+            # - https://github.com/Deltares/HYDROLIB-core/issues/290
+            # by creating these files ourselves and then copying them
+            shutil.copytree(initial_files, build_ws, dirs_exist_ok=True)
+
+            for dirpath, _, filenames in os.walk(build_ws):
+                for filename in filenames:
+                    os.chmod(os.path.join(dirpath, filename), stat.S_IREAD)
+        except BaseException:
+            remove_workspace(build_ws)
+            raise
+
+        # a directory can only be renamed onto a missing path, so the
+        # old template is moved aside first
+        old_ws = None
+        if os.path.exists(template_ws):
+            old_ws = f"{build_ws}.old"
+            os.rename(template_ws, old_ws)
+        os.rename(build_ws, template_ws)
+        _write_stamp(template_ws, template_hash)
+        if old_ws is not None:
+            remove_workspace(old_ws)
+    return template_ws
+
+
+def _reflink(src, dst):
+    import fcntl
+
+    ficlone = 0x40049409
+    with open(src, "rb") as fsrc, open(dst, "wb") as fdst:
+        fcntl.ioctl(fdst.fileno(), ficlone, fsrc.fileno())
+    return
+
+
+def link_file(src, dst):
+    """Hard link src to dst, falling back to a reflink (Linux) and then
+    to a copy, and return the method that was used
+
+    """
+    try:
+        os.link(src, dst)
+        return "linked"
+    except OSError:
+        pass
+    if sys.platform.startswith("linux"):
+        try:
+            _reflink(src, dst)
+            return "reflinked"
+        except OSError:
+            if os.path.exists(dst):
+                os.remove(dst)
+    shutil.copy2(src, dst)
+    return "copied"
+
+
+def provision_workspace(
+    modelws,
+    modelname="model",
+    copy_files=default_copy_files,
+    build_kwargs=None,
+    clean=True,
+    verbose=False,
+):
+    """Create a D-FLOW FM run directory from the template for modelname
+
+    Template files are hard linked (or reflinked) and are read-only, so
+    files that are modified during a run must be listed in copy_files.
+    Files written by flopy (the MODFLOW 6 model) are not part of the
+    template.
+
+    """
+    t0 = time.perf_counter()
+    template_hash = get_template_hash(modelname, build_kwargs=build_kwargs)
+    if clean:
+        remove_workspace(modelws)
+
+    copy_files = {name.format(modelname=modelname) for name in copy_files}
+    while True:
+        template_ws = build_template(
+            modelname,
+            build_kwargs=build_kwargs,
+            verbose=verbose,
+        )
+        with template_lock(modelname, shared=True):
+            # the template can be rebuilt for other build_kwargs between
+            # build_template and taking the shared lock
+            if template_is_current(template_ws, template_hash):
+                counts = _link_template(template_ws, modelws, copy_files)
+                break
+
+    setup_time = time.perf_counter() - t0
+    if verbose:
+        print(
+            f"provisioned {modelws} in {setup_time:.3f} s "
+            + f"(linked: {counts['linked']}, "
+            + f"reflinked: {counts['reflinked']}, "
+            + f"copied: {counts['copied']})"
+        )
+    return setup_time, counts
+
+
+def _link_template(template_ws, modelws, copy_files):
+    counts = {"linked": 0, "reflinked": 0, "copied": 0}
+    for dirpath, _, filenames in os.walk(template_ws):
+        relpath = os.path.relpath(dirpath, template_ws)
+        dstdir = os.path.normpath(os.path.join(modelws, relpath))
+        os.makedirs(dstdir, exist_ok=True)
+        for filename in filenames:
+            if filename == template_stamp:
+                continue
+            src = os.path.join(dirpath, filename)
+            dst = os.path.join(dstdir, filename)
+            if os.path.exists(dst):
+                # never changes the mode of a hard link to the template
+                _remove_file(dst)
+            relname = os.path.normpath(os.path.join(relpath, filename))
+            if relname in copy_files:
+                shutil.copyfile(src, dst)
+                counts["copied"] += 1
+            else:
+                counts[link_file(src, dst)] += 1
+                # hard links share the mode of the template file
+                os.chmod(dst, stat.S_IREAD)
+    return counts